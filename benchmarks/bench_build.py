@@ -0,0 +1,92 @@
+"""
+Build time benchmark of the double array
+Compare the incremental builder (DoubleArray.insert one by one) with the bulk builder.
+
+usage:
+    python -m benchmarks.bench_build --size 100000
+    python -m benchmarks.bench_build --dict_path ./data/mecab-ipadic-2.7.0-20070801
+"""
+import argparse
+import random
+from time import time
+from comugi.double_array import DoubleArray
+import utils.dict_loader as dl
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Benchmark double array build.")
+    parser.add_argument(
+        "--dict_path",
+        "-d",
+        help="Path to the dictionary (random vocabularies are used if not given)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--dict_type", "-t", help="type of dictionary", type=str, default="mecab-ipa"
+    )
+    parser.add_argument(
+        "--size", "-s", help="number of random vocabularies", type=int, default=50000
+    )
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    parser.add_argument(
+        "--skip_incremental",
+        help="build with the bulk builder only",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+def random_vocabularies(size, seed=0):
+    rng = random.Random(seed)
+    hiragana = [chr(c) for c in range(0x3041, 0x3094)]
+    katakana = [chr(c) for c in range(0x30A1, 0x30F5)]
+    kanji = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    alphabet = [chr(c) for c in range(0x61, 0x7B)]
+    pools = (hiragana, katakana, kanji, alphabet)
+
+    vocabularies = set()
+    while len(vocabularies) < size:
+        pool = rng.choice(pools)
+        length = rng.choice((1, 2, 2, 3, 3, 4, 5, 8))
+        vocabularies.add("".join(rng.choice(pool) for _ in range(length)))
+    return sorted(vocabularies)
+
+
+def timed_build(vocabularies, bulk):
+    da = DoubleArray()
+    start = time()
+    da.build(vocabularies, bulk=bulk)
+    return da, time() - start
+
+
+def verify(da, reference, vocabularies):
+    for vocab in vocabularies:
+        encoded = vocab.encode("utf-8")
+        if da.common_prefix_search(encoded) != reference.common_prefix_search(encoded):
+            return False
+        # also query a string which is not a vocabulary
+        encoded = (vocab + vocab[::-1]).encode("utf-8")
+        if da.common_prefix_search(encoded) != reference.common_prefix_search(encoded):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    args = argparser()
+
+    if args.dict_path is None:
+        vocabularies = random_vocabularies(args.size, args.seed)
+    else:
+        dictionary, _ = dl.load_dictionary(args.dict_path, args.dict_type)
+        vocabularies = sorted(dictionary.keys())
+    print(f"Number of vocabularies = {len(vocabularies)}")
+
+    bulk_da, bulk_time = timed_build(vocabularies, bulk=True)
+    print(f"bulk        : {bulk_time:.3f}[sec] (array size = {len(bulk_da.base)})")
+
+    if not args.skip_incremental:
+        inc_da, inc_time = timed_build(vocabularies, bulk=False)
+        print(f"incremental : {inc_time:.3f}[sec] (array size = {len(inc_da.base)})")
+        print(f"speedup     : x{inc_time / bulk_time:.1f}")
+        print(f"identical search results : {verify(bulk_da, inc_da, vocabularies)}")
@@ -0,0 +1,251 @@
+"""
+Benchmark suite on a synthetic dictionary
+A mecab format dictionary is generated, built by build.py and loaded by Comugi, then
+build time, load time and memory, tokenize throughput and N-best scaling are measured.
+
+usage:
+    python -m benchmarks.bench_suite --size 100000 --output result.json
+    python -m benchmarks.bench_suite --output new.json --compare result.json
+    python -m benchmarks.bench_suite --compare result.json --against new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+import build
+from benchmarks.synthetic import SCRIPTS, SyntheticDictionary
+from comugi.comugi import Comugi
+from utils import const
+
+
+DICT_TYPE = "mecab-ipa"
+MIXES = tuple(SCRIPTS) + ("mixed", "unknown")
+LENGTHS = (10, 100, 1000)
+NBESTS = (1, 2, 5, 10, 50)
+
+# suffix of metric name -> whether larger values are better
+METRIC_DIRECTIONS = {"_per_sec": True, "_sec": False, "_ms": False, "_mb": False}
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Benchmark suite on a synthetic dictionary.")
+    parser.add_argument(
+        "--size", "-s", help="number of entries of the dictionary", type=int, default=50000
+    )
+    parser.add_argument("--n_ids", help="number of context ids", type=int, default=300)
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    parser.add_argument(
+        "--chars",
+        help="number of characters tokenized for each text type",
+        type=int,
+        default=20000,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="number of repetitions of each measurement (the fastest one is taken)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--work_dir",
+        help="directory for the generated and built dictionaries (temporary if not given)",
+        default=None,
+    )
+    parser.add_argument("--output", "-o", help="save results to json", default=None)
+    parser.add_argument(
+        "--compare", "-c", help="baseline json to compare the results with", default=None
+    )
+    parser.add_argument(
+        "--against", help="compare this json with the baseline instead of running", default=None
+    )
+    parser.add_argument(
+        "--threshold",
+        help="relative change regarded as a regression",
+        type=float,
+        default=0.1,
+    )
+    return parser.parse_args()
+
+
+def data_paths(data_dir):
+    """paths of the built dictionaries in the order of Comugi arguments"""
+    suffixes = (
+        const.DOUBLEARRAY_FILE_SUFFIX,
+        const.LEXICON_FILE_SUFFIX,
+        const.VOCABULARY_FILE_SUFFIX,
+        const.MATRIX_FILE_SUFFIX,
+        const.CATEGORY_RANGE_FILE_SUFFIX,
+        const.CATEGORY_POLICY_FILE_SUFFIX,
+    )
+    return [str(Path(data_dir) / f"{DICT_TYPE}-{suffix}") for suffix in suffixes]
+
+
+LOAD_SCRIPT = """
+import json, resource, sys
+from time import perf_counter
+from comugi.comugi import Comugi
+start = perf_counter()
+if len(sys.argv) == 2:
+    comugi = Comugi.from_bundle(sys.argv[1])
+else:
+    comugi = Comugi(*sys.argv[1:])
+comugi.tokenize("テスト")  # the first call decodes the sections of a bundle
+elapsed = perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"time": elapsed, "rss_kb": rss_kb}))
+"""
+
+
+def bench_load(data_dir):
+    # measured in a fresh process so that the memory of this process is not counted
+    root = Path(__file__).resolve().parent.parent
+    bundle_path = str(Path(data_dir) / f"{DICT_TYPE}-{const.BUNDLE_FILE_SUFFIX}")
+    metrics = {}
+    for name, paths in (("load", data_paths(data_dir)), ("load_bundle", [bundle_path])):
+        out = subprocess.run(
+            [sys.executable, "-c", LOAD_SCRIPT] + paths,
+            cwd=root,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(out.splitlines()[-1])
+        metrics[f"{name}.time_sec"] = result["time"]  # until the first tokenize returns
+        metrics[f"{name}.rss_mb"] = result["rss_kb"] / 1024  # peak, including the interpreter
+    return metrics
+
+
+def fastest(func, repeat):
+    """minimum elapsed time of func and its result"""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_tokenize(comugi, synthetic, n_chars, seed, repeat):
+    metrics = {}
+    for mix in MIXES:
+        for length in LENGTHS:
+            rng = random.Random(seed)
+            texts = [
+                synthetic.text(length, mix, rng) for _ in range(max(n_chars // length, 1))
+            ]
+            elapsed, n_tokens = fastest(
+                lambda: sum(len(comugi.tokenize(t)[0]) - 2 for t in texts),  # without BOS, EOS
+                repeat,
+            )
+            name = f"tokenize.{mix}.{length}"
+            metrics[f"{name}.tokens_per_sec"] = n_tokens / elapsed
+            metrics[f"{name}.chars_per_sec"] = len(texts) * length / elapsed
+    return metrics
+
+
+def bench_nbest(comugi, synthetic, seed, repeat, n_sentences=100, length=50):
+    rng = random.Random(seed)
+    texts = [synthetic.text(length, "mixed", rng) for _ in range(n_sentences)]
+    metrics = {}
+    for n in NBESTS:
+        elapsed, _ = fastest(lambda: [comugi.tokenize(t, n) for t in texts], repeat)
+        metrics[f"nbest.{n}.per_sentence_ms"] = 1000 * elapsed / n_sentences
+    return metrics
+
+
+def run(args, work_dir):
+    dict_path = Path(work_dir) / "dict"
+    data_dir = Path(work_dir) / "data"
+
+    synthetic = SyntheticDictionary(args.size, args.n_ids, args.seed)
+    synthetic.write(dict_path)
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        elapsed = build.build(dict_path, DICT_TYPE, data_dir)
+    metrics = {f"build.{step}_sec": t for step, t in elapsed.items()}
+
+    metrics.update(bench_load(data_dir))
+
+    comugi = Comugi(*data_paths(data_dir))
+    metrics.update(bench_tokenize(comugi, synthetic, args.chars, args.seed, args.repeat))
+    metrics.update(bench_nbest(comugi, synthetic, args.seed, args.repeat))
+
+    return {
+        "config": {
+            "size": args.size,
+            "n_ids": args.n_ids,
+            "seed": args.seed,
+            "chars": args.chars,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "metrics": metrics,
+    }
+
+
+def higher_is_better(name):
+    for suffix, direction in METRIC_DIRECTIONS.items():
+        if name.endswith(suffix):
+            return direction
+    return None
+
+
+def compare(baseline, result, threshold):
+    """print changes of every metric, and return names of regressed metrics"""
+    if baseline["config"] != result["config"]:
+        print("warning : configurations differ", file=sys.stderr)
+
+    regressions = []
+    print(f"{'metric':<40}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, value in result["metrics"].items():
+        if name not in baseline["metrics"]:
+            continue
+        base = baseline["metrics"][name]
+        change = (value - base) / base if base != 0 else 0.0
+        better = higher_is_better(name)
+        regressed = better is not None and (
+            change < -threshold if better else change > threshold
+        )
+        mark = "  REGRESSION" if regressed else ""
+        print(f"{name:<40}{base:>14.4g}{value:>14.4g}{100 * change:>9.1f}%{mark}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    args = argparser()
+
+    if args.against is not None:
+        with open(args.against) as f:
+            result = json.load(f)
+    elif args.work_dir is not None:
+        result = run(args, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            result = run(args, work_dir)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regression(s) beyond {100 * args.threshold:.0f}%")
+            sys.exit(1)
+    else:
+        for name, value in result["metrics"].items():
+            print(f"{name:<40}{value:>14.4g}")
@@ -0,0 +1,198 @@
+"""
+Synthetic dictionary in mecab format (ipadic layout) for benchmarks
+The real dictionaries are not needed : the files are generated from a seed.
+"""
+import random
+from pathlib import Path
+
+
+ENCODING = "euc_jp"
+
+HIRAGANA = [chr(c) for c in range(0x3041, 0x3094)]
+KATAKANA = [chr(c) for c in range(0x30A1, 0x30F5)]
+# kanji which can be encoded in euc_jp (as ipadic)
+KANJI = []
+for _c in range(0x4E00, 0x9FA0):
+    try:
+        chr(_c).encode(ENCODING)
+        KANJI.append(chr(_c))
+    except UnicodeEncodeError:
+        pass
+ALPHABET = [chr(c) for c in range(0x61, 0x7B)] + [chr(c) for c in range(0x41, 0x5B)]
+DIGITS = [chr(c) for c in range(0x30, 0x3A)]
+SYMBOLS = list("、。「」・！？（）")
+SCRIPTS = {"hiragana": HIRAGANA, "katakana": KATAKANA, "kanji": KANJI}
+
+# (file name, pos, pos1, weight of script kanji, hiragana, katakana)
+PARTS_OF_SPEECH = (
+    ("Noun.csv", "名詞", "一般", (0.6, 0.1, 0.3)),
+    ("Noun.proper.csv", "名詞", "固有名詞", (0.5, 0.0, 0.5)),
+    ("Verb.csv", "動詞", "自立", (0.5, 0.5, 0.0)),
+    ("Adj.csv", "形容詞", "自立", (0.4, 0.6, 0.0)),
+    ("Adverb.csv", "副詞", "一般", (0.2, 0.8, 0.0)),
+    ("Postp.csv", "助詞", "格助詞", (0.0, 1.0, 0.0)),
+    ("Auxil.csv", "助動詞", "*", (0.0, 1.0, 0.0)),
+)
+WORD_LENGTHS = (1, 1, 2, 2, 2, 2, 3, 3, 3, 4, 4, 5, 6, 8)
+
+CHAR_DEF = """\
+# synthetic char.def
+DEFAULT 0 1 0
+SPACE 0 1 0
+KANJI 0 0 2
+SYMBOL 1 1 0
+NUMERIC 1 1 0
+ALPHA 1 1 0
+HIRAGANA 0 1 2
+KATAKANA 1 1 2
+KANJINUMERIC 1 1 0
+
+0x0020 SPACE  # DO NOT REMOVE THIS LINE, 0x0020 is reserved for SPACE
+0x00D0 SPACE
+0x0009 SPACE
+0x000B SPACE
+0x000A SPACE
+0x0021..0x002F SYMBOL
+0x0030..0x0039 NUMERIC
+0x003A..0x0040 SYMBOL
+0x0041..0x005A ALPHA
+0x005B..0x0060 SYMBOL
+0x0061..0x007A ALPHA
+0x007B..0x007E SYMBOL
+0x3000..0x303F SYMBOL
+0x3041..0x309F HIRAGANA
+0x30A1..0x30FF KATAKANA
+0x4E00..0x9FFF KANJI
+0x4E00 KANJINUMERIC
+0x4E8C KANJINUMERIC
+0x4E09 KANJINUMERIC
+0xFF01..0xFF0F SYMBOL
+0xFF10..0xFF19 NUMERIC
+"""
+UNK_CATEGORIES = (
+    "DEFAULT",
+    "SPACE",
+    "KANJI",
+    "SYMBOL",
+    "NUMERIC",
+    "ALPHA",
+    "HIRAGANA",
+    "KATAKANA",
+    "KANJINUMERIC",
+)
+
+
+class SyntheticDictionary:
+    """
+    Random mecab dictionary and texts made of its words
+    Attributes
+    ----------
+    size : int
+        number of entries of csv files
+    n_ids : int
+        number of context ids (size of matrix.def is n_ids x n_ids)
+    entries : [(file name, row)]
+        rows of csv files
+    words : dict
+        script name -> surfaces of the entries written in the script
+    """
+
+    def __init__(self, size, n_ids=300, seed=0):
+        self.size = size
+        self.n_ids = n_ids
+        self.seed = seed
+        rng = random.Random(seed)
+
+        self.entries = []
+        self.words = {name: [] for name in SCRIPTS}
+        for i in range(size):
+            file_name, pos, pos1, weights = rng.choice(PARTS_OF_SPEECH)
+            script = rng.choices(tuple(SCRIPTS), weights)[0]
+            pool = SCRIPTS[script]
+            # short words are frequent in particles and auxiliaries
+            length = 1 + i % 2 if pos in ("助詞", "助動詞") else rng.choice(WORD_LENGTHS)
+            surface = "".join(rng.choice(pool) for _ in range(length))
+            context_id = rng.randrange(1, n_ids)
+            row = (
+                surface,
+                context_id,
+                context_id,
+                rng.randrange(-1000, 10000),
+                pos,
+                pos1,
+                "*",
+                "*",
+                "*",
+                "*",
+                surface,
+                surface,
+                surface,
+            )
+            self.entries.append((file_name, row))
+            self.words[script].append(surface)
+
+        self.all_words = [entry[1][0] for entry in self.entries]
+        self._rng = rng
+
+    def write(self, dict_path):
+        """write csv files, matrix.def, char.def and unk.def to dict_path"""
+        dict_path = Path(dict_path)
+        dict_path.mkdir(parents=True, exist_ok=True)
+        rng = random.Random(self.seed + 1)
+
+        files = {}
+        try:
+            for file_name, row in self.entries:
+                if file_name not in files:
+                    files[file_name] = open(dict_path / file_name, "w", encoding=ENCODING)
+                files[file_name].write(",".join(map(str, row)) + "\n")
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(dict_path / "matrix.def", "w", encoding=ENCODING) as f:
+            f.write(f"{self.n_ids} {self.n_ids}\n")
+            for lid in range(self.n_ids):
+                for rid in range(self.n_ids):
+                    cost = rng.randrange(-3000, 3000) if lid and rid else 0
+                    f.write(f"{lid} {rid} {cost}\n")
+
+        with open(dict_path / "char.def", "w", encoding=ENCODING) as f:
+            f.write(CHAR_DEF)
+
+        with open(dict_path / "unk.def", "w", encoding=ENCODING) as f:
+            for category in UNK_CATEGORIES:
+                for pos1 in ("一般", "サ変接続"):
+                    lid = rng.randrange(1, self.n_ids)
+                    cost = rng.randrange(3000, 12000)
+                    f.write(f"{category},{lid},{lid},{cost},名詞,{pos1},*,*,*,*,*\n")
+
+    def text(self, length, mix="mixed", rng=None):
+        """
+        random text of length characters
+        mix is a script name (words and letters of the script), "mixed" (words of
+        all the scripts with symbols) or "unknown" (alphabets, digits and symbols)
+        """
+        rng = rng or self._rng
+        pieces = []
+        n = 0
+        while n < length:
+            if mix == "unknown":
+                pool = rng.choice((ALPHABET, DIGITS, SYMBOLS))
+                piece = "".join(rng.choice(pool) for _ in range(rng.randrange(1, 6)))
+            elif mix == "mixed":
+                r = rng.random()
+                if r < 0.85:
+                    piece = rng.choice(self.all_words)
+                elif r < 0.95:
+                    piece = rng.choice(SYMBOLS)
+                else:
+                    piece = "".join(rng.choice(ALPHABET + DIGITS) for _ in range(3))
+            else:
+                if rng.random() < 0.8 and len(self.words[mix]) > 0:
+                    piece = rng.choice(self.words[mix])
+                else:
+                    piece = rng.choice(SCRIPTS[mix])
+            pieces.append(piece)
+            n += len(piece)
+        return "".join(pieces)[:length]
@@ -2,7 +2,10 @@ from pathlib import Path
 from time import time
 import argparse
 import pickle
+from comugi.bundle import save_bundle
+from comugi.char_category import CharCategoryTable
 from comugi.double_array import DoubleArray
+from comugi.lattice import CostManager, Lexicon
 import utils.dict_loader as dl
 from utils import const
 
@@ -19,90 +22,157 @@ def argparser():
     parser.add_argument(
         "--dict_type", "-t", help="type of dictionary", type=str, default="mecab-ipa"
     )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        help="number of processes parsing csv files (number of cpus by default)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--tail",
+        help="build the double array in the TAIL layout (smaller index)",
+        action="store_true",
+    )
     return parser.parse_args()
 
 
-if __name__ == "__main__":
+def print_size_report(da):
+    report = da.size_report()
+    print(f"Cells = {report['cells']} (used = {report['used_cells']})")
+    print(f"Tail = {report['tail_entries']} entries, {report['tail_bytes']} bytes")
+    print(f"Index size = {report['total_bytes'] / 1024 / 1024:.2f}[MB]")
 
-    args = argparser()
+
+def build(
+    dict_path,
+    dict_type="mecab-ipa",
+    data_dir=const.DATA_DIR,
+    processes=None,
+    tail=False,
+):
+    """
+    build dictionaries of Comugi from mecab dictionary in dict_path, and save them in data_dir
+    Returns elapsed time [sec] of each step.
+    """
+    elapsed = {}
 
     # create data directory if not exist
-    if not Path(const.DATA_DIR).is_dir():
-        Path(const.DATA_DIR).mkdir()
+    if not Path(data_dir).is_dir():
+        Path(data_dir).mkdir(parents=True)
 
     # load all vocabularies and save them in readable format to comugi
     print("-" * 20)
-    print("Load word dictionary")   
-    dictionary, vocabularies = dl.load_dictionary(args.dict_path, args.dict_type)
+    print("Load word dictionary")
+    start = time()
+    dictionary, vocab_container = dl.load_dictionary(dict_path, dict_type, processes)
 
     # load unknown word dictionary
-    unk_dictionary = dl.load_unk_dictionary(args.dict_path, args.dict_type)
+    unk_dictionary = dl.load_unk_dictionary(dict_path, dict_type)
 
-    # merge normal dictionary and unknown word dictionary
-    sz = len(vocabularies)
+    # append unknown word dictionary (looked up by char category, not by the double array)
+    sz = len(vocab_container)
+    unk_vocabularies = []
+    unk_ids = {}
     for k, v in unk_dictionary.items():
-        vocabularies.extend(v)
+        unk_vocabularies.extend(v)
         l = len(v)
-        dictionary[k].extend(list(range(sz, sz + l)))
+        unk_ids[k] = list(range(sz, sz + l))
         sz += l
+    vocab_container.extend(unk_vocabularies)
+
+    # extract surface from dictionary
+    # the value of each surface in the double array is its index in the lexicon
+    surfaces = list(dictionary.keys())
+    surfaces.sort()
+    lexicon = Lexicon([dictionary[s] for s in surfaces], unk_ids)
+    del dictionary
 
     # dict save
-    dict_savepath = Path(
-        f"{const.DATA_DIR}/{args.dict_type}-{const.DICTIONARY_FILE_SUFFIX}"
+    lexicon_savepath = Path(
+        f"{data_dir}/{dict_type}-{const.LEXICON_FILE_SUFFIX}"
     )
     vocab_savepath = Path(
-        f"{const.DATA_DIR}/{args.dict_type}-{const.VOCABULARY_FILE_SUFFIX}"
+        f"{data_dir}/{dict_type}-{const.VOCABULARY_FILE_SUFFIX}"
     )
-    with open(dict_savepath, "wb") as f:
-        pickle.dump(dictionary, f, protocol=4)
+    with open(lexicon_savepath, "wb") as f:
+        pickle.dump(lexicon, f, protocol=4)
     with open(vocab_savepath, "wb") as f:
-        pickle.dump(vocabularies, f, protocol=4)
+        pickle.dump(vocab_container, f, protocol=4)
+    elapsed["vocabulary"] = time() - start
     print("Done.")
 
 
-    # extract surface from dictionary
-    surfaces = list(dictionary.keys())
-    surfaces.sort()
-
     # double array build up
     print("-" * 20)
     print("Build up double array index.")
     da = DoubleArray()
     start = time()
-    da.build(surfaces)
+    da.build(surfaces, tail=tail)
     end = time()
+    elapsed["double_array"] = end - start
     da_savepath = Path(
-        f"{const.DATA_DIR}/{args.dict_type}-{const.DOUBLEARRAY_FILE_SUFFIX}"
+        f"{data_dir}/{dict_type}-{const.DOUBLEARRAY_FILE_SUFFIX}"
     )
     da.save(da_savepath)
     print("Done.")
     print(f"Elapsed time = {end - start:.3f}[sec]")
+    print_size_report(da)
 
     # load transition cost matrix file
     print("-" * 20)
     print("Load transition cost matrix")
-    cm = dl.load_cost_matrix(args.dict_path, args.dict_type)
-    mat_savepath = Path(f"{const.DATA_DIR}/{args.dict_type}-{const.MATRIX_FILE_SUFFIX}")
-    with open(mat_savepath, "wb") as f:
-        pickle.dump(cm, f, protocol=4)
+    start = time()
+    cm = CostManager(dl.load_cost_matrix(dict_path, dict_type))
+    mat_savepath = Path(f"{data_dir}/{dict_type}-{const.MATRIX_FILE_SUFFIX}")
+    cm.save(mat_savepath)
+    elapsed["matrix"] = time() - start
     print("Done.")
 
 
     # load char category policy
     print("-" * 20)
     print("Load char category policy")
-    char_cat_policy, char_cat_range = dl.load_char_def(args.dict_path, args.dict_type)
+    start = time()
+    char_cat_policy, char_cat_range = dl.load_char_def(dict_path, dict_type)
 
     cat_policy_savepath = Path(
-        f"{const.DATA_DIR}/{args.dict_type}-{const.CATEGORY_POLICY_FILE_SUFFIX}"
+        f"{data_dir}/{dict_type}-{const.CATEGORY_POLICY_FILE_SUFFIX}"
     )
     with open(cat_policy_savepath, "wb") as f:
         pickle.dump(char_cat_policy, f, protocol=4)
 
     cat_range_savepath = Path(
-        f"{const.DATA_DIR}/{args.dict_type}-{const.CATEGORY_RANGE_FILE_SUFFIX}"
+        f"{data_dir}/{dict_type}-{const.CATEGORY_RANGE_FILE_SUFFIX}"
     )
+    char_cat_table = CharCategoryTable(char_cat_range)
     with open(cat_range_savepath, "wb") as f:
-        pickle.dump(char_cat_range, f, protocol=4)
+        pickle.dump(char_cat_table, f, protocol=4)
 
+    elapsed["char_def"] = time() - start
+    print("Done.")
+
+    # all the dictionaries in one file
+    print("-" * 20)
+    print("Write dictionary bundle")
+    start = time()
+    bundle_savepath = Path(f"{data_dir}/{dict_type}-{const.BUNDLE_FILE_SUFFIX}")
+    save_bundle(
+        bundle_savepath,
+        dict_type,
+        da,
+        lexicon,
+        vocab_container,
+        cm,
+        char_cat_table,
+        char_cat_policy,
+    )
+    elapsed["bundle"] = time() - start
     print("Done.")
+
+    return elapsed
+
+
+if __name__ == "__main__":
+    args = argparser()
+    build(args.dict_path, args.dict_type, processes=args.processes, tail=args.tail)
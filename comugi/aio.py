@@ -0,0 +1,197 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from . import parallel
+
+
+def _tokenize_requests(comugi, requests):
+    """results of (sentence, best_n) pairs, or the exceptions raised by them"""
+    results = []
+    for sentence, best_n in requests:
+        try:
+            results.append(comugi.tokenize(sentence, best_n))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _tokenize_requests_in_worker(requests):
+    return _tokenize_requests(parallel._worker_comugi, requests)
+
+
+class AsyncComugi:
+    """
+    asyncio front end of Comugi with micro-batching
+    Concurrent calls of tokenize are collected into a batch (until max_batch_size requests
+    arrive or max_delay seconds pass after the first one), and each batch is tokenized
+    by one call on a worker pool. Every request has its own future, so an error or a
+    cancellation affects only that request.
+    Callers wait in tokenize when max_pending requests are queued (backpressure), and at
+    most `workers` batches run at once.
+    Parameters
+    ----------
+    comugi : Comugi
+        tokenizer shared by the workers
+    max_batch_size : int
+        maximum number of requests in one batch
+    max_delay : float
+        maximum time [sec] to wait for more requests after the first one of a batch
+    max_pending : int
+        maximum number of queued requests
+    workers : int
+        number of batches tokenized at once (lattice pool size of comugi by default)
+    processes : bool
+        tokenize in worker processes attached to the dictionaries in shared memory
+        instead of threads (the GIL does not limit the throughput)
+    """
+
+    def __init__(
+        self,
+        comugi,
+        max_batch_size=64,
+        max_delay=0.002,
+        max_pending=4096,
+        workers=None,
+        processes=False,
+    ):
+        assert max_batch_size >= 1
+        assert max_pending >= 1
+        self.comugi = comugi
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.workers = workers or comugi.lattice_pool.max_size
+        self.processes = processes
+
+        self._handle = None
+        self._executor = None
+        self._queue = None
+        self._batch_ready = None
+        self._slots = None
+        self._batcher = None
+        self._running = set()
+        self._closed = False
+
+    async def __aenter__(self):
+        self._start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _start(self):
+        if self._closed:
+            raise RuntimeError("AsyncComugi was closed")
+        if self._batcher is not None:
+            return
+        if self.processes:
+            self._handle = parallel.SharedDictionary(self.comugi)
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                initializer=parallel._init_worker,
+                initargs=(self._handle,),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(self.workers)
+        self._queue = asyncio.Queue(self.max_pending)
+        self._batch_ready = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._batcher = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def tokenize(self, sentence, best_n=1):
+        """tokenize sentence in a batch with the other concurrent requests"""
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((sentence, best_n, future))
+        if self._closed:  # closed while waiting for the queue
+            raise RuntimeError("AsyncComugi was closed")
+        if self._queue.qsize() >= self.max_batch_size - 1:  # with the one taken by the batcher
+            self._batch_ready.set()
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        if self.max_delay > 0 and self._queue.qsize() < self.max_batch_size - 1:
+            self._batch_ready.clear()
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # closed while waiting for more requests
+                self._fail(batch)
+                raise
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        # requests cancelled while waiting are not tokenized
+        return [request for request in batch if not request[2].cancelled()]
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if len(batch) == 0:
+                continue
+            try:
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                self._fail(batch)
+                raise
+
+            requests = [(sentence, best_n) for sentence, best_n, _ in batch]
+            if self.processes:
+                task = loop.run_in_executor(
+                    self._executor, _tokenize_requests_in_worker, requests
+                )
+            else:
+                task = loop.run_in_executor(
+                    self._executor, _tokenize_requests, self.comugi, requests
+                )
+            self._running.add(task)
+            task.add_done_callback(lambda task, batch=batch: self._resolve(task, batch))
+
+    def _resolve(self, task, batch):
+        self._running.discard(task)
+        self._slots.release()
+        if task.cancelled():
+            results = [asyncio.CancelledError()] * len(batch)
+        elif task.exception() is not None:
+            results = [task.exception()] * len(batch)  # e.g. a worker process died
+        else:
+            results = task.result()
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():  # cancelled by the caller
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _fail(self, batch):
+        """fail the requests of batch which are not done yet"""
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("AsyncComugi was closed"))
+
+    async def close(self):
+        """finish the running batches, fail the queued requests and stop the workers"""
+        self._closed = True
+        if self._batcher is None:
+            return
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        if len(self._running) > 0:
+            await asyncio.wait(list(self._running))
+
+        queued = []
+        while not self._queue.empty():
+            queued.append(self._queue.get_nowait())
+        self._fail(queued)
+
+        self._executor.shutdown(wait=True)
+        if self._handle is not None:
+            self._handle.close()
+        self._batcher = None
@@ -0,0 +1,243 @@
+import mmap
+import os
+import pickle
+import struct
+import sys
+import zlib
+from array import array
+import numpy as np
+from .double_array import DoubleArray
+from .lattice import CostManager, Lexicon, StringTable, VocabContainer
+
+
+# file : HEADER | SECTION * n_sections | sections (aligned)
+# header : MAGIC | version | number of sections | crc32 of the section table | dictionary type
+MAGIC = b"COMUGIDC"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIII32s")
+# section : name | format | offset | number of bytes | crc32 of the bytes
+# format is a typecode of memoryview (little endian), or "pickle" for python objects
+SECTION = struct.Struct("<32s8sQQI4x")
+ALIGNMENT = 64
+
+VOCAB_COLUMNS = ("lid", "rid", "em_cost", "length", "known") + VocabContainer.STRING_COLUMNS
+
+
+class BundleError(Exception):
+    pass
+
+
+def _buffers(
+    da,
+    lexicon,
+    vocab_container,
+    cost_manager,
+    char_category_table,
+    char_category_policy,
+):
+    """name -> (format, bytes-like) of all the sections"""
+    sections = {}
+    sections["da.base"] = ("i", array("i", da.base))
+    sections["da.check"] = ("i", array("i", da.check))
+    sections["da.tail"] = ("B", da.tail)
+    sections["da.tail_offsets"] = ("i", array("i", da.tail_offsets))
+    sections["da.tail_values"] = ("i", array("i", da.tail_values))
+    sections["lexicon.offsets"] = ("i", lexicon.offsets)
+    sections["lexicon.ids"] = ("i", lexicon.ids)
+
+    matrix = cost_manager.matrix
+    sections["matrix.shape"] = ("I", array("I", matrix.shape))
+    sections["matrix"] = (matrix.dtype.char, np.ascontiguousarray(matrix))
+
+    for column in VOCAB_COLUMNS:
+        buf = getattr(vocab_container, column)
+        sections[f"vocab.{column}"] = (memoryview(buf).format, buf)
+    sections["strings.blob"] = ("B", vocab_container.strings.blob)
+    sections["strings.offsets"] = ("i", vocab_container.strings.offsets)
+
+    for name, obj in (
+        ("lexicon.unk_ids", lexicon.unk_ids),
+        ("char_category_table", char_category_table),
+        ("char_category_policy", char_category_policy),
+    ):
+        sections[name] = ("pickle", pickle.dumps(obj, protocol=4))
+    return sections
+
+
+def save_bundle(
+    filepath,
+    dict_type,
+    da,
+    lexicon,
+    vocab_container,
+    cost_manager,
+    char_category_table,
+    char_category_policy,
+):
+    """write all the dictionaries of Comugi into one file"""
+    if sys.byteorder != "little":
+        raise BundleError("dictionary bundle is written on little endian machines only")
+
+    sections = _buffers(
+        da,
+        lexicon,
+        vocab_container,
+        cost_manager,
+        char_category_table,
+        char_category_policy,
+    )
+
+    table = []
+    offset = HEADER.size + SECTION.size * len(sections)
+    for name, (fmt, buf) in sections.items():
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        view = memoryview(buf).cast("B")
+        table.append(
+            SECTION.pack(
+                name.encode(), fmt.encode(), offset, view.nbytes, zlib.crc32(view)
+            )
+        )
+        offset += view.nbytes
+    table = b"".join(table)
+
+    with open(filepath, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC, FORMAT_VERSION, len(sections), zlib.crc32(table), dict_type.encode()
+            )
+        )
+        f.write(table)
+        for fmt, buf in sections.values():
+            f.write(b"\0" * (-f.tell() % ALIGNMENT))
+            f.write(memoryview(buf).cast("B"))
+
+
+class DictionaryBundle:
+    """
+    Dictionaries of Comugi in one memory-mapped file
+    Sections are decoded when they are used first : arrays are views of the mapped file
+    (no copy), and python objects are unpickled.
+    Attributes
+    ----------
+    path : str
+        path of the bundle
+    version : int
+        format version
+    dict_type : str
+        type of the dictionary (e.g. mecab-ipa)
+    sections : dict
+        name -> (format, offset, number of bytes, crc32)
+    """
+
+    # parts of Comugi made of sections
+    PARTS = (
+        "da",
+        "lexicon",
+        "vocab_container",
+        "cost_manager",
+        "char_category_table",
+        "char_category_policy",
+    )
+
+    def __init__(self, filepath, verify=False):
+        self.path = str(filepath)
+        with open(filepath, "rb") as f:
+            # an empty file cannot be mapped
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise BundleError(f"{filepath} is not a dictionary bundle")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, n_sections, table_crc, dict_type = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise BundleError(f"{filepath} is not a dictionary bundle")
+        if version != FORMAT_VERSION:
+            raise BundleError(
+                f"{filepath} has format version {version}, but {FORMAT_VERSION} is supported"
+                " (rebuild it with build.py)"
+            )
+        self.version = version
+        self.dict_type = dict_type.rstrip(b"\0").decode()
+
+        table = self._view[HEADER.size : HEADER.size + SECTION.size * n_sections]
+        if zlib.crc32(table) != table_crc:
+            raise BundleError(f"{filepath} is broken (section table)")
+        self.sections = {}
+        for i in range(n_sections):
+            name, fmt, offset, nbytes, crc = SECTION.unpack_from(table, SECTION.size * i)
+            if offset + nbytes > len(self._mmap):
+                raise BundleError(f"{filepath} is truncated")
+            self.sections[name.rstrip(b"\0").decode()] = (
+                fmt.rstrip(b"\0").decode(),
+                offset,
+                nbytes,
+                crc,
+            )
+
+        if verify:
+            self.verify()
+
+    def verify(self):
+        """check crc32 of all the sections (reads the whole file)"""
+        for name, (_, offset, nbytes, crc) in self.sections.items():
+            if zlib.crc32(self._view[offset : offset + nbytes]) != crc:
+                raise BundleError(f"{self.path} is broken (section {name})")
+
+    def section(self, name):
+        """decoded section : memoryview of the typed array, or unpickled object"""
+        if name not in self.sections:
+            raise BundleError(f"{self.path} has no section {name}")
+        fmt, offset, nbytes, _ = self.sections[name]
+        view = self._view[offset : offset + nbytes]
+        if fmt == "pickle":
+            return pickle.loads(view)
+        if sys.byteorder != "little" and view.itemsize > 1:
+            a = array(fmt, view.tobytes())
+            a.byteswap()
+            return a
+        return view.cast(fmt)
+
+    def part(self, name):
+        """one of PARTS built from its sections"""
+        return getattr(self, f"_load_{name}")()
+
+    def _load_da(self):
+        da = DoubleArray()
+        da.base = self.section("da.base")
+        da.check = self.section("da.check")
+        if "da.tail" in self.sections:  # bundles written before the TAIL layout have no tail
+            da.tail = self.section("da.tail")
+            da.tail_offsets = self.section("da.tail_offsets")
+            da.tail_values = self.section("da.tail_values")
+        return da
+
+    def _load_lexicon(self):
+        lexicon = Lexicon()
+        lexicon.offsets = self.section("lexicon.offsets")
+        lexicon.ids = self.section("lexicon.ids")
+        lexicon.unk_ids = self.section("lexicon.unk_ids")
+        return lexicon
+
+    def _load_vocab_container(self):
+        vc = VocabContainer()
+        for column in VOCAB_COLUMNS:
+            setattr(vc, column, self.section(f"vocab.{column}"))
+        strings = StringTable()
+        strings.blob = self.section("strings.blob")
+        strings.offsets = self.section("strings.offsets")
+        vc.strings = strings
+        return vc
+
+    def _load_cost_manager(self):
+        shape = tuple(self.section("matrix.shape"))
+        fmt, offset, nbytes, _ = self.sections["matrix"]
+        dtype = np.dtype(fmt)
+        if sys.byteorder != "little":
+            dtype = dtype.newbyteorder("<")
+        matrix = np.ndarray(shape, dtype=dtype, buffer=self._mmap, offset=offset)
+        return CostManager(matrix)
+
+    def _load_char_category_table(self):
+        return self.section("char_category_table")
+
+    def _load_char_category_policy(self):
+        return self.section("char_category_policy")
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "entries", "tokens", "max_entries", "max_tokens"]
+)
+
+
+class TokenizeCache:
+    """
+    Bounded LRU cache of tokenization results
+    Results are immutable tuples of tokens, so they are returned as they are.
+    Attributes
+    ----------
+    max_entries : int
+        maximum number of cached results
+    max_tokens : int
+        maximum number of tokens in all the cached results (no limit if None)
+        Long results are evicted by the size as well as by the number of entries.
+    """
+
+    def __init__(self, max_entries=10000, max_tokens=None):
+        assert max_entries >= 1
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._n_tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def count_tokens(result):
+        return sum(len(path) for path in result)
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        n_tokens = self.count_tokens(result)
+        if self.max_tokens is not None and n_tokens > self.max_tokens:
+            return  # never fits
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._n_tokens -= self.count_tokens(old)
+            self._entries[key] = result
+            self._n_tokens += n_tokens
+
+            while len(self._entries) > self.max_entries or (
+                self.max_tokens is not None and self._n_tokens > self.max_tokens
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._n_tokens -= self.count_tokens(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._n_tokens = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.misses,
+                self.evictions,
+                len(self._entries),
+                self._n_tokens,
+                self.max_entries,
+                self.max_tokens,
+            )
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,124 @@
+from array import array
+from bisect import bisect_right
+
+
+BMP_SIZE = 0x10000
+NOT_FOUND = 0xFF
+
+
+class CharCategoryTable:
+    """
+    Character category lookup table compiled from char.def
+    Code points in BMP are looked up in a dense array, and the others by bisect
+    on a sorted range table.
+    Attributes
+    ----------
+    names : [str]
+        category names in the order of char.def
+    primary : array
+        index of the first category (in the order of names) of each BMP code point
+    masks : array
+        bit set of all the categories of each BMP code point
+    astral_starts, astral_primary, astral_masks : array
+        sorted segments of code points beyond BMP and their categories
+    default : int
+        category of code points which are not defined in char.def
+        (category of "#" as Comugi did before)
+    """
+
+    def __init__(self, char_category_range):
+        self.names = list(char_category_range.keys())
+        assert len(self.names) < NOT_FOUND
+        assert len(self.names) <= 64
+
+        self.primary = array("B", [NOT_FOUND]) * BMP_SIZE
+        self.masks = array("Q", [0]) * BMP_SIZE
+        astral_segments = []
+        for idx, name in enumerate(self.names):
+            bit = 1 << idx
+            for lo, hi in char_category_range[name]:
+                for cp in range(lo, min(hi, BMP_SIZE - 1) + 1):
+                    self.masks[cp] |= bit
+                    if self.primary[cp] == NOT_FOUND:
+                        self.primary[cp] = idx
+                if hi >= BMP_SIZE:
+                    astral_segments.append((max(lo, BMP_SIZE), hi, idx))
+
+        self._build_astral(astral_segments)
+
+        hash_idx = self.primary[ord("#")]
+        if hash_idx != NOT_FOUND:
+            self.default = hash_idx
+        elif "DEFAULT" in self.names:
+            self.default = self.names.index("DEFAULT")
+        else:
+            self.default = 0
+
+        self._setup()
+
+    def _build_astral(self, segments):
+        # split overlapping ranges at every boundary so that each segment has fixed categories
+        bounds = sorted({lo for lo, _, _ in segments} | {hi + 1 for _, hi, _ in segments})
+        self.astral_starts = array("I")
+        self.astral_primary = array("B")
+        self.astral_masks = array("Q")
+        for start in bounds:
+            mask = 0
+            for lo, hi, idx in segments:
+                if lo <= start <= hi:
+                    mask |= 1 << idx
+            self.astral_starts.append(start)
+            self.astral_masks.append(mask)
+            self.astral_primary.append(
+                (mask & -mask).bit_length() - 1 if mask else NOT_FOUND
+            )
+
+    def _setup(self):
+        # category name of every BMP code point, resolved once for classify
+        names = self.names
+        default = names[self.default]
+        self._bmp_names = [
+            default if idx == NOT_FOUND else names[idx] for idx in self.primary
+        ]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_bmp_names"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    def _astral_index(self, cp):
+        pos = bisect_right(self.astral_starts, cp) - 1
+        if pos < 0:
+            return NOT_FOUND, 0
+        return self.astral_primary[pos], self.astral_masks[pos]
+
+    def lookup(self, c):
+        """name of the first category of c"""
+        cp = ord(c)
+        if cp < BMP_SIZE:
+            return self._bmp_names[cp]
+        idx, _ = self._astral_index(cp)
+        return self.names[self.default if idx == NOT_FOUND else idx]
+
+    def categories(self, c):
+        """names of all the categories of c"""
+        cp = ord(c)
+        if cp < BMP_SIZE:
+            mask = self.masks[cp]
+        else:
+            _, mask = self._astral_index(cp)
+        if mask == 0:
+            return (self.names[self.default],)
+        return tuple(name for i, name in enumerate(self.names) if mask >> i & 1)
+
+    def classify(self, sentence):
+        """names of the first category of every character in sentence"""
+        bmp_names = self._bmp_names
+        return [
+            bmp_names[cp] if cp < BMP_SIZE else self.lookup(chr(cp))
+            for cp in map(ord, sentence)
+        ]
@@ -1,178 +1,498 @@
 import sys
 import pickle
+from . import parallel, stream
+from .bundle import DictionaryBundle, save_bundle
+from .cache import TokenizeCache
+from .char_category import CharCategoryTable
 from .double_array import DoubleArray
-from .lattice import Lattice, CostManager, Vocab, NodePointer, VocabContainer
+from .stats import TokenizeStats
+from .user_dictionary import UserDictionary, format_row, read_rows
+from .lattice import (
+    BOS_SURFACE,
+    EOS_SURFACE,
+    Lattice,
+    LatticePool,
+    CostManager,
+    Lexicon,
+    Vocab,
+    NodePointer,
+    VocabContainer,
+)
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from functools import lru_cache
+from time import perf_counter
+
+
+def _special_vocab(surface):
+    return Vocab(
+        {
+            "surface": surface,
+            "pos": None,
+            "pos1": None,
+            "base": None,
+            "pronunciation": None,
+            "lid": 0,
+            "rid": 0,
+            "em_cost": 0,
+        }
+    )
+
+
+BOS_VOCAB = _special_vocab(BOS_SURFACE)
+EOS_VOCAB = _special_vocab(EOS_SURFACE)
 
 
 class Comugi:
     def __init__(
         self,
         double_array_path,
-        dictitonary_path,
+        lexicon_path,
         vocabulary_path,
         matrix_path,
         char_range_path,
         char_policy_path,
+        max_lattices=8,
     ):
-        self.da = DoubleArray()
-        self.da.load(double_array_path)
-
-        self.lattice = Lattice()
+        da = DoubleArray()
+        try:
+            da.load(double_array_path)
+        except OSError as e:
+            print("File open error: {}".format(e), file=sys.stderr)
+            sys.exit(1)
+        except ValueError as e:
+            print("Format error: {}".format(e), file=sys.stderr)
+            sys.exit(1)
 
-        self.dictionary = self.load(dictitonary_path)
+        lexicon = self.load(lexicon_path)
+        if not isinstance(lexicon, Lexicon):  # surface -> ids (old format)
+            print(
+                "Format error: {} is not a lexicon (rebuild the dictionaries with build.py)".format(
+                    lexicon_path
+                ),
+                file=sys.stderr,
+            )
+            sys.exit(1)
 
         v = self.load(vocabulary_path)
-        vocabs = list(map(lambda x: Vocab(x), v))
-        self.vocab_container = VocabContainer(vocabs)
-        del v, vocabs
+        if isinstance(v, VocabContainer):
+            vocab_container = v
+        else:  # list of dict (old format)
+            vocab_container = VocabContainer.from_items(v)
+        del v
+
+        if str(matrix_path).endswith(".npy"):
+            cost_manager = CostManager.load(matrix_path)
+        else:  # pickled list of lists (old format)
+            cost_manager = CostManager(self.load(matrix_path))
 
-        mat = self.load(matrix_path)
-        self.cost_manager = CostManager(mat)
+        char_category_table = self.load(char_range_path)
+        char_category_policy = self.load(char_policy_path)
 
-        self.char_category_range = self.load(char_range_path)
-        self.char_category_policy = self.load(char_policy_path)
+        self._set_parts(
+            da,
+            lexicon,
+            vocab_container,
+            cost_manager,
+            char_category_table,
+            char_category_policy,
+            max_lattices,
+        )
+
+    @classmethod
+    def from_parts(
+        cls,
+        da,
+        lexicon,
+        vocab_container,
+        cost_manager,
+        char_category_table,
+        char_category_policy,
+        max_lattices=8,
+    ):
+        """create Comugi from already loaded dictionaries (e.g. attached to shared memory)"""
+        comugi = cls.__new__(cls)
+        comugi._set_parts(
+            da,
+            lexicon,
+            vocab_container,
+            cost_manager,
+            char_category_table,
+            char_category_policy,
+            max_lattices,
+        )
+        return comugi
+
+    @classmethod
+    def from_bundle(cls, filepath, max_lattices=8, verify=False):
+        """
+        create Comugi from a dictionary bundle written by build.py (or save_bundle)
+        The file is memory-mapped, and each part of the dictionary is decoded when it is used first.
+        Parameters
+        ----------
+        filepath : str
+            path of the bundle
+        max_lattices : int
+            maximum number of lattices used at once
+        verify : bool
+            check the checksums of all the sections (reads the whole file)
+        """
+        comugi = cls.__new__(cls)
+        comugi.bundle = DictionaryBundle(filepath, verify)
+        comugi.lattice_pool = LatticePool(max_lattices)
+        comugi.cache = None
+        comugi.stats = None
+        comugi.user_dictionary = None
+        return comugi
+
+    def __getattr__(self, name):
+        # parts of a bundle are decoded at the first access, and set as plain attributes
+        bundle = self.__dict__.get("bundle")
+        if bundle is None or name not in DictionaryBundle.PARTS:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        value = bundle.part(name)
+        setattr(self, name, value)
+        return value
+
+    def save_bundle(self, filepath, dict_type):
+        """write all the dictionaries into one file, which can be loaded by from_bundle"""
+        save_bundle(
+            filepath,
+            dict_type,
+            self.da,
+            self.lexicon,
+            self.vocab_container,
+            self.cost_manager,
+            self.char_category_table,
+            self.char_category_policy,
+        )
+
+    def _set_parts(
+        self,
+        da,
+        lexicon,
+        vocab_container,
+        cost_manager,
+        char_category_table,
+        char_category_policy,
+        max_lattices,
+    ):
+        self.bundle = None
+        self.da = da
+
+        # lattices are borrowed per tokenization so that threads can share this instance
+        self.lattice_pool = LatticePool(max_lattices)
+
+        self.lexicon = lexicon
+        self.vocab_container = vocab_container
+        self.cost_manager = cost_manager
+
+        if not isinstance(char_category_table, CharCategoryTable):
+            # raw ranges from char.def (old format) are compiled here
+            char_category_table = CharCategoryTable(char_category_table)
+        self.char_category_table = char_category_table
+        self.char_category_policy = char_category_policy
+
+        self.cache = None  # see enable_cache
+        self.stats = None  # see enable_stats
+        self.user_dictionary = None  # see add_user_dictionary
 
     def load(self, filepath):
         try:
             with open(filepath, "rb") as f:
                 return pickle.load(f)
         except Exception as e:
-            print(e)
-            sys.exit()
+            print(e, file=sys.stderr)
+            sys.exit(1)
 
-    @lru_cache(maxsize=2048)
     def detect_char_category(self, c):
-        ord_c = ord(c)
-        for key in self.char_category_range.keys():
-            segments = self.char_category_range[key]
-            for seg in segments:
-                if seg[0] <= ord_c and ord_c <= seg[1]:
-                    return key
-        # warnings.warn(f"Letter {c} was not found in any category.")
-        return self.detect_char_category("#")
-
-    def filter_unknown_words(self, sentence, char_category):
-        idx = 0
-        unk_words = [[] for _ in range(len(sentence))]
-        while idx < len(sentence):
-            cat_name = char_category[idx]
-            unk_group = self.char_category_policy[cat_name]["group"]
-            unk_length = self.char_category_policy[cat_name]["length"]
-
-            tmp_idx = idx
-
-            # group same category letters as long as possible
-            if unk_group == 1:
-                tmp_word = ""
-                while idx < len(sentence):
-                    cur_cat_name = char_category[idx]
-                    cur_char = sentence[idx]
-                    if cat_name == cur_cat_name:
-                        tmp_word += cur_char
-                        idx += 1
-                    else:
-                        break
-                unk_words[tmp_idx].append(tmp_word)
-
-            # group same category letters by predefined length
-            else:
-                tmp_word = ""
-                t = 0
-                while t < unk_length and idx + t < len(sentence):
-                    cur_cat_name = char_category[idx + t]
-                    cur_char = sentence[idx + t]
-                    if cat_name == cur_cat_name:
-                        t += 1
-                        tmp_word += cur_char
-                        unk_words[tmp_idx].append(tmp_word)
-                    else:
-                        break
-                idx += 1
-
-        return unk_words
-
-    def set_node_pointer(self, idx, vocab):
-        lid = vocab.get_lid()
-        rid = vocab.get_rid()
-        em_cost = vocab.get_em_cost()
-        return NodePointer(idx, lid, rid, em_cost, len(vocab.surface))
-
-    def set_lattice(self, sentence):
-        self.lattice.set_sentence(sentence)
-        char_category = [self.detect_char_category(c) for c in sentence]
-
-        unk_words_list = self.filter_unknown_words(sentence, char_category)
-
-        vocab_counter = 0
-
-        def regist_unk_words(unk_words, category_name):
-            idxs = self.dictionary[category_name]
-            for unk_word in unk_words:
-                for idx in idxs:
-                    vocab = self.vocab_container[idx]
-                    vocab.surface = unk_word
-                    node_ptr = self.set_node_pointer(idx, vocab)
-                    self.lattice.insert(
-                        begin=i, node_ptr=node_ptr, node=vocab, length=len(unk_word)
-                    )
+        return self.char_category_table.lookup(c)
+
+    def unknown_word_spans(self, char_category, begin):
+        """
+        (begin, length, category) of the unknown words beginning at begin
+        A run of a grouping category is one word from its first character (no word begins
+        in the middle of the run), and the other categories give words of 1 to "length"
+        characters of the same category.
+        """
+        cat_name = char_category[begin]
+        policy = self.char_category_policy[cat_name]
+        end = len(char_category)
+
+        # group same category letters as long as possible
+        if policy["group"] == 1:
+            if begin > 0 and char_category[begin - 1] == cat_name:
+                return []
+            last = begin + 1
+            while last < end and char_category[last] == cat_name:
+                last += 1
+            return [(begin, last - begin, cat_name)]
+
+        # group same category letters by predefined length
+        spans = []
+        length = 1
+        while (
+            length <= policy["length"]
+            and begin + length <= end
+            and char_category[begin + length - 1] == cat_name
+        ):
+            spans.append((begin, length, cat_name))
+            length += 1
+        return spans
+
+    def set_node_pointer(self, lattice, begin, idx, length):
+        vc = self.vocab_container
+        return lattice.new_node(
+            begin, idx, vc.lid[idx], vc.rid[idx], vc.em_cost[idx], length
+        )
+
+    def set_lattice(self, sentence, lattice=None, context=None):
+        if lattice is None:
+            lattice = Lattice()
+        stats = self.stats
+        if stats is not None:
+            t = perf_counter()
+
+        lattice.set_sentence(sentence, context)
+        char_category = self.char_category_table.classify(sentence)
+        if stats is not None:
+            t = stats.lap("char_category", t)
+
+        lexicon = self.lexicon
+        user = self.user_dictionary
+
+        # unknown words are looked for only at the positions which need them
+        unknown_word_spans = self.unknown_word_spans
+        if stats is not None:
+            unknown_word_spans = stats.timed("unknown_words", unknown_word_spans)
+
+        def regist_unk_words(spans):
+            for begin, length, category_name in spans:
+                for idx in lexicon.unk_ids.get(category_name, ()):
+                    self.set_node_pointer(lattice, begin, idx, length)
 
         def regist_words(words):
-            for common_prefix_str in words:
-                idxs = self.dictionary[common_prefix_str]
-                for idx in idxs:
-                    vocab = self.vocab_container[idx]
-                    node_ptr = self.set_node_pointer(idx, vocab)
-                    self.lattice.insert(
-                        begin=i,
-                        node_ptr=node_ptr,
-                        node=vocab,
-                        length=len(common_prefix_str),
+            for _, char_end, key in words:
+                for idx in lexicon.word_ids(key):
+                    self.set_node_pointer(lattice, i, idx, char_end - i)
+
+        def regist_user_words(words):
+            uvc = user.vocab_container
+            for _, char_end, key in words:
+                for idx in user.word_ids[key]:
+                    local = idx - user.id_offset
+                    lattice.new_node(
+                        i, idx, uvc.lid[local], uvc.rid[local], uvc.em_cost[local], char_end - i
                     )
 
+        # encode the sentence once and search it from the byte offset of each character
+        encoded = sentence.encode("utf-8")
+        byte_offsets = [pos for pos, b in enumerate(encoded) if b & 0xC0 != 0x80]
+
+        common_prefix_search = self.da.common_prefix_search
+        if stats is not None:
+            common_prefix_search = stats.timed("dictionary_search", common_prefix_search)
+        if user is not None:
+            user_prefix_search = user.da.common_prefix_search
+            if stats is not None:
+                user_prefix_search = stats.timed("dictionary_search", user_prefix_search)
+
         for i in range(len(sentence)):
             cat_name = char_category[i]
 
+            # user words are looked up at every position (even where unknown word
+            # handling is always invoked), and count as known words
+            user_found = False
+            if user is not None:
+                user_res = user_prefix_search(encoded, byte_offsets[i], i)
+                if len(user_res) > 0:
+                    regist_user_words(user_res)
+                    user_found = True
+
             # check whether to invoke unknown word handling
             unk_invoke = self.char_category_policy[cat_name]["invoke"]
 
-            # It assumes the categories of unk_words beginning from the same idx are all identical.
             if unk_invoke == 1:  # always invoke
-                unk_words = unk_words_list[i]
-                regist_unk_words(unk_words, cat_name)
+                regist_unk_words(unknown_word_spans(char_category, i))
 
             else:  # invoke when any vocabulary was not found in (known) dictionary
-                input_str = sentence[i:]
-                res = self.da.search(input_str.encode("utf-8"))
+                res = common_prefix_search(encoded, byte_offsets[i], i)
                 if len(res) > 0:
                     regist_words(res)
-                else:
-                    unk_words = unk_words_list[i]
-                    regist_unk_words(unk_words, cat_name)
+                elif not user_found:
+                    regist_unk_words(unknown_word_spans(char_category, i))
+
+        if stats is not None:
+            stats.lap("build_lattice", t)
+        return lattice
 
     def get_node(self, node_ptr):
+        """vocabulary of a token (or a node) whose features are decoded when accessed"""
         idx = node_ptr.ptr
-        if idx == -1 or idx == -2:
-            return Vocab(
-                {
-                    "surface": "__BOS__" if idx == -1 else "__EOS__",
-                    "pos": None,
-                    "pos1": None,
-                    "base": None,
-                    "pronunciation": None,
-                    "lid": 0,
-                    "rid": 0,
-                    "em_cost": 0,
-                }
-            )
+        if idx == -1:
+            return BOS_VOCAB
+        elif idx == -2:
+            return EOS_VOCAB
+        elif idx >= len(self.vocab_container):
+            user = self.user_dictionary
+            return user.vocab_container[idx - user.id_offset]
+        else:
+            return self.vocab_container[idx]
+
+    def add_user_dictionary(self, path_or_entries, encoding="utf-8"):
+        """
+        add words to the user dictionary, which is looked up together with the system
+        dictionary (the system dictionary itself is not changed)
+        Parameters
+        ----------
+        path_or_entries : str or [[str]]
+            mecab format csv (ipadic layout), or its rows
+        encoding : str
+            encoding of the csv
+        Returns
+        -------
+        n_words : int
+            number of the added words
+        """
+        items = [format_row(row) for row in read_rows(path_or_entries, encoding)]
+        n_lids, n_rids = self.cost_manager.matrix.shape
+        for item in items:
+            if not (0 <= item["lid"] < n_lids and 0 <= item["rid"] < n_rids):
+                raise ValueError(f"context ids of {item['surface']} are not in matrix.def")
+
+        if self.user_dictionary is None:
+            self.user_dictionary = UserDictionary(len(self.vocab_container))
+        self.user_dictionary.add(items)
+        self.clear_cache()
+        return len(items)
+
+    def save_user_dictionary(self, filepath):
+        """save the user dictionary in compiled form (see load_user_dictionary)"""
+        if self.user_dictionary is None:
+            raise ValueError("no user dictionary is added")
+        self.user_dictionary.save(filepath)
+
+    def load_user_dictionary(self, filepath):
+        """replace the user dictionary with a compiled one saved by save_user_dictionary"""
+        user_dictionary = UserDictionary.load(filepath)
+        if user_dictionary.id_offset != len(self.vocab_container):
+            raise ValueError(f"{filepath} was compiled for another system dictionary")
+        self.user_dictionary = user_dictionary
+        self.clear_cache()
+
+    def clear_user_dictionary(self):
+        self.user_dictionary = None
+        self.clear_cache()
+
+    def enable_cache(self, max_entries=10000, max_tokens=None):
+        """
+        cache results of tokenize by (sentence, best_n) with LRU eviction
+        Parameters
+        ----------
+        max_entries : int
+            maximum number of cached sentences
+        max_tokens : int
+            maximum number of tokens in all the cached results (no limit if None)
+        """
+        self.cache = TokenizeCache(max_entries, max_tokens)
+
+    def disable_cache(self):
+        self.cache = None
+
+    def clear_cache(self):
+        """drop all the cached results (e.g. when the dictionary was changed)"""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_info(self):
+        """hits, misses, evictions and size of the cache (None if disabled)"""
+        if self.cache is None:
+            return None
+        return self.cache.info()
+
+    def enable_stats(self):
+        """
+        profile tokenization by phases (wall time) and counters of lattices
+        Profiling costs nothing while disabled.
+        """
+        self.stats = TokenizeStats()
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    def calc_path(self, lattice, best_n):
+        stats = self.stats
+        if stats is None:
+            return lattice.calc_path(self.cost_manager, best_n)
+
+        t = perf_counter()
+        lattice.calc_forward_cost(self.cost_manager)
+        t = stats.lap("forward", t)
+        if best_n == 1:
+            paths = lattice.get_best_path()
+            stats.lap("backtrack", t)
         else:
-            return node_ptr.get_node(self.vocab_container)
+            paths = lattice.get_nbest_path(self.cost_manager, best_n, count_pushes=True)
+            stats.lap("nbest", t)
+            stats.add(heap_pushes=lattice.n_heap_pushes)
+        stats.count_lattice(lattice, self.vocab_container)
+        return paths
 
     def tokenize(self, sentence, best_n=1):
         assert best_n >= 1
         assert type(best_n) is int
-        self.set_lattice(sentence)
-        # print(len(self.lattice))
-        tokens = self.lattice.calc_path(self.cost_manager, best_n)
+
+        cache = self.cache
+        if cache is not None:
+            tokens = cache.get((sentence, best_n))
+            if tokens is not None:
+                return tokens
+
+        with self.lattice_pool.lattice() as lattice:
+            self.set_lattice(sentence, lattice)
+            paths = self.calc_path(lattice, best_n)
+            tokens = tuple(tuple(lattice.to_tokens(path)) for path in paths)
+
+        if cache is not None:
+            cache.put((sentence, best_n), tokens)
         return tokens
+
+    def iter_nbest(self, sentence, max_heap_size=None):
+        """
+        yield tokens of the paths from the best one lazily
+        The lattice is held until the generator is exhausted or closed.
+        """
+        with self.lattice_pool.lattice() as lattice:
+            self.set_lattice(sentence, lattice)
+            lattice.calc_forward_cost(self.cost_manager)
+            for path in lattice.iter_nbest_path(self.cost_manager, max_heap_size):
+                yield lattice.to_tokens(path)
+
+    def tokenize_batch(self, sentences, best_n=1, workers=None):
+        """
+        tokenize sentences with a thread pool sharing this instance
+        Results are returned in the order of sentences.
+        """
+        if workers is None:
+            workers = self.lattice_pool.max_size
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda s: self.tokenize(s, best_n), sentences))
+
+    def tokenize_many(self, sentences, best_n=1, processes=None, chunksize=64):
+        """
+        tokenize sentences with a process pool
+        Dictionaries are placed in shared memory once and attached by every worker.
+        Results are yielded in the order of sentences.
+        """
+        return parallel.tokenize_many(self, sentences, best_n, processes, chunksize)
+
+    def tokenize_stream(self, texts, chunk_size=4096):
+        """
+        tokenize a long document given as an iterable of texts (e.g. a file), yielding tokens
+        The document is analyzed by windows of about chunk_size characters, so the memory is
+        bounded. It is cut where the best path is already determined, and the result is the
+        same as the best path of the whole document; only when such a position does not
+        exist in a window (e.g. a very long run of unknown characters), it is cut after a
+        sentence end and the result may differ around there.
+        """
+        return stream.tokenize_stream(self, texts, chunk_size)
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+from array import array
 from enum import Enum
+import mmap
 import os
+import struct
 import sys
 import time
 from tqdm import tqdm
@@ -9,12 +12,87 @@ from tqdm import tqdm
 
 class FLAGS:
     UNUSED = 0
-    END = -sys.maxsize
+
+
+# every key ends with a transition by TERMINAL to a leaf, whose base holds -(value + 1)
+# (keys must not contain this byte)
+TERMINAL = 0
+
+# binary format : MAGIC | version (uint32) | size (uint32) | TAIL_HEADER (version >= 3)
+#                 | base (int32 * size) | check (int32 * size)
+#                 | tail_offsets (int32 * (n_entries + 1)) | tail_values (int32 * n_entries)
+#                 | tail (n_bytes) (version >= 3)
+# version 1 had no values (terminal nodes were marked by negative bases)
+MAGIC = b"COMUGIDA"
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (2, 3)
+HEADER = struct.Struct("<8sII")
+TAIL_HEADER = struct.Struct("<II")  # number of entries | number of bytes
+
+
+class FreeList:
+    """
+    Doubly linked list of unused cells used by the bulk builder
+    Attributes
+    ----------
+    head : int
+        first unused cell (-1 if none)
+    """
+
+    def __init__(self, size):
+        self.next = list(range(1, size + 1))
+        self.prev = list(range(-1, size - 1))
+        self.next[-1] = -1
+        self.head = 0 if size > 0 else -1
+        self.tail = size - 1
+
+    def extend(self, diff):
+        start = len(self.next)
+        self.next.extend(range(start + 1, start + diff + 1))
+        self.prev.extend(range(start - 1, start + diff - 1))
+        self.next[-1] = -1
+        self.prev[start] = self.tail
+        if self.tail == -1:
+            self.head = start
+        else:
+            self.next[self.tail] = start
+        self.tail = start + diff - 1
+
+    def head_from(self, idx):
+        """drop the cells before idx from the list (they are left unused)"""
+        cur = self.head
+        while cur != idx:
+            self.prev[cur] = -2
+            cur = self.next[cur]
+        self.prev[idx] = -1
+        self.head = idx
+
+    def remove(self, idx):
+        prev_idx = self.prev[idx]
+        if prev_idx == -2:  # already removed
+            return
+        next_idx = self.next[idx]
+        self.prev[idx] = -2
+        if prev_idx == -1:
+            self.head = next_idx
+        else:
+            self.next[prev_idx] = next_idx
+        if next_idx == -1:
+            self.tail = prev_idx
+        else:
+            self.prev[next_idx] = prev_idx
 
 
 class DoubleArray:
     """
     CRUD on Double array
+    Each key carries an int value (e.g. index of its vocabulary ids), which is stored in
+    the base of the leaf reached from the last node of the key by TERMINAL.
+
+    With the TAIL layout (build_bulk with tail=True), the first node whose subtree has only
+    one key is a tail node instead : its base is -(entry + 1), and the rest of the key
+    and its value are kept in the tail entry. A tail node is told from a leaf by its label
+    (leaves are reached by TERMINAL only).
     Attributes
     ----------
     base : int
@@ -27,14 +105,30 @@ class DoubleArray:
     most_r : int
         rightmost index ever used
         (currently not used)
+    tail : bytes
+        suffixes of the tail entries
+    tail_offsets : array
+        tail_offsets[e]:tail_offsets[e + 1] is the suffix of the e-th entry in tail
+    tail_values : array
+        value of each tail entry
+
+    After loading a binary file, base and check (and the tail) are read-only views on a
+    memory-mapped file, so the pages are shared between processes.
+    base and check are copied into lists on the first insert.
     """
 
+    # the bulk builder gives up the free cells near the head of the free list
+    # when more than this number of them were visited to place one child set
+    MAX_VISITED_FREE_CELLS = 0x40
+
     def __init__(self):
         self.block_size = 0xFFFF
         self.base = [FLAGS.UNUSED] * self.block_size
         self.check = [FLAGS.UNUSED] * self.block_size
+        self._clear_tail()
 
-        self.start_point = 1  # from which search begins
+        self.start_point = 2  # from which search begins (0 and 1 (root) are never children)
+        self.mmap_path = None  # file mapped to base and check
 
     def debug(self):
         xlim = 20
@@ -43,77 +137,177 @@ class DoubleArray:
         print()
         print("----" * xlim)
         for b in self.base[1 : xlim + 1]:
-            if b == FLAGS.END:
-                print("|  E", end="")
-            else:
-                print("|{:3}".format(b), end="")
+            print("|{:3}".format(b), end="")
         print()
 
         for c in self.check[1 : xlim + 1]:
-            if c == FLAGS.END:
-                print("|  E", end="")
-            else:
-                print("|{:3}".format(c), end="")
+            print("|{:3}".format(c), end="")
         print()
         print("ARRAY SIZE: ", len(self.base))
 
+    def _clear_tail(self):
+        self.tail = b""
+        self.tail_offsets = array("i", [0])
+        self.tail_values = array("i")
+
+    def _tail_entry(self, entry):
+        """suffix and value of a tail entry"""
+        suffix = bytes(self.tail[self.tail_offsets[entry] : self.tail_offsets[entry + 1]])
+        return suffix, self.tail_values[entry]
+
+    def size_report(self):
+        """number of cells, used cells, tail entries and bytes of the index"""
+        cells = len(self.base)
+        return {
+            "cells": cells,
+            "used_cells": 1 + sum(1 for c in self.check if c != FLAGS.UNUSED),  # with root
+            "tail_entries": len(self.tail_values),
+            "tail_bytes": len(self.tail),
+            "total_bytes": 8 * cells
+            + len(self.tail)
+            + 4 * (len(self.tail_offsets) + len(self.tail_values)),
+        }
+
+    def _ensure_writable(self):
+        if not isinstance(self.base, list):
+            self.base = list(self.base)
+            self.check = list(self.check)
+            self.mmap_path = None
+
     def extend_array(self, diff):
         self.base.extend([FLAGS.UNUSED] * diff)
         self.check.extend([FLAGS.UNUSED] * diff)
 
     def search(self, sentence):
-        code_point = sentence
+        return [
+            sentence[:byte_end].decode("utf-8")
+            for byte_end, _, _ in self.common_prefix_search(sentence)
+        ]
+
+    def lookup(self, key):
+        """
+        value of key (utf-8 encoded), or None if key is not in the double array
+        """
+        base = self.base
+        check = self.check
+
+        s = 1
+        for pos, point in enumerate(key):
+            next_s = base[s] + point
+            if point == TERMINAL or check[next_s] != s:
+                return None
+            s = next_s
+
+            if base[s] < 0:  # tail node
+                entry = -base[s] - 1
+                start = self.tail_offsets[entry]
+                end = self.tail_offsets[entry + 1]
+                if key[pos + 1 :] != self.tail[start:end]:
+                    return None
+                return self.tail_values[entry]
+
+        leaf = base[s] + TERMINAL
+        if check[leaf] != s:
+            return None
+        return -base[leaf] - 1
+
+    def common_prefix_search(self, code_point, offset=0, char_offset=0):
+        """
+        search all the vocabularies which are prefixes of code_point[offset:]
+        without slicing or decoding code_point
+        Parameters
+        ----------
+        code_point : bytes
+            utf-8 encoded sentence
+        offset : int
+            byte offset from which search begins
+        char_offset : int
+            character offset corresponding to offset
+        Returns
+        -------
+        result : [(int, int, int)]
+            byte and character offsets where each matched vocabulary ends, and its value
+        """
+        base = self.base
+        check = self.check
 
         s = 1
         result = []
-        num_point = 0
-        for point in code_point:
+        n_chars = char_offset
+        n = len(code_point)
+        for pos in range(offset, len(code_point)):
+            point = code_point[pos]
 
-            next_s = abs(self.base[s]) + point
-            next_check = self.check[next_s]
-            if next_check == s:
-                s = next_s
-                num_point += 1
-            else:
-                # print("遷移失敗 : ", sentence)
+            next_s = base[s] + point
+            if check[next_s] != s or point == TERMINAL:
                 break  # 遷移失敗→検索終わったので抜ける
-
-            if self.base[s] < 0:
-                result.append(code_point[:num_point].decode("utf-8"))
-                if self.base[s] == FLAGS.END:
-                    break
+            s = next_s
+
+            # count only leading bytes of utf-8 sequences
+            if point & 0xC0 != 0x80:
+                n_chars += 1
+
+            b = base[s]
+            if b < 0:
+                # tail node : the only key below it matches if the rest of it follows
+                entry = -b - 1
+                start = self.tail_offsets[entry]
+                end = self.tail_offsets[entry + 1]
+                tail_end = pos + 1 + end - start
+                if tail_end <= n and code_point[pos + 1 : tail_end] == self.tail[start:end]:
+                    # the suffix may begin with the rest of a character, which is ignored
+                    n_chars += len(code_point[pos + 1 : tail_end].decode("utf-8", "ignore"))
+                    result.append((tail_end, n_chars, self.tail_values[entry]))
+                break
+
+            leaf = b + TERMINAL
+            if check[leaf] == s:
+                result.append((pos + 1, n_chars, -base[leaf] - 1))
 
         return result
 
-    def insert(self, vocabulary):
+    def insert(self, vocabulary, value=0):
         """
         Parameters
         ----------
-        vocabulary : str
-            inserted vocabulary
+        vocabulary : bytes
+            inserted vocabulary (utf-8 encoded)
+        value : int
+            non-negative value of the vocabulary (overwritten if already inserted)
         Returns
         -------
         """
-        code_point = vocabulary
+        assert value >= 0
+        assert TERMINAL not in vocabulary
+        self._ensure_writable()
+        self._insert_from(1, list(vocabulary) + [TERMINAL], value)
 
-        s = 1
+    def _insert_from(self, s, code_point, value):
+        """insert code_point (ending with TERMINAL) below the node s"""
         for point in code_point:
+            if self.base[s] < 0:
+                # tail node : expand the rest of its key into nodes
+                # (the entry is left unused in tail)
+                suffix, tail_value = self._tail_entry(-self.base[s] - 1)
+                self.base[s] = FLAGS.UNUSED
+                self._insert_from(s, list(suffix) + [TERMINAL], tail_value)
+
             cur_base = self.base[s]
 
             if cur_base >= 0.9 * len(self.base):
                 self.extend_array(self.block_size)
 
-            if cur_base == FLAGS.UNUSED or cur_base == FLAGS.END:
+            if cur_base == FLAGS.UNUSED:
                 # 今見てる番号のbaseは使われていない
                 # この場合はこのpointのみの遷移を探せばいい
                 x = self._search_position([point])
-                self.base[s] = -x if cur_base == FLAGS.END else x
+                self.base[s] = x
                 self.check[x + point] = s
                 s = x + point
             else:
                 # 今見てるbaseはすでに使われている
                 # この場合はこのbaseからの遷移がOKかここからは未踏か競合してるかの3択
-                check_pos = abs(self.base[s]) + point
+                check_pos = self.base[s] + point
                 if self.check[check_pos] == FLAGS.UNUSED:
                     # 未踏
                     self.check[check_pos] = s
@@ -133,12 +327,10 @@ class DoubleArray:
                     self._resolve_confliction(s, x, conflict_indices, conflict_points)
 
                     # 引き続き処理する
-                    s = abs(self.base[s]) + point
-        else:
-            if self.base[s] == FLAGS.UNUSED:
-                self.base[s] = FLAGS.END
-            else:
-                self.base[s] = -abs(self.base[s])
+                    s = self.base[s] + point
+
+        # s is the leaf
+        self.base[s] = -value - 1
 
     def _check_confliction(self, s, point):
         """
@@ -159,8 +351,8 @@ class DoubleArray:
         conflict_points = [point]
 
         # 高速化版
-        cur_base = abs(self.base[s])
-        for idx in range(cur_base, cur_base + 0xFF):
+        cur_base = self.base[s]
+        for idx in range(cur_base, cur_base + 0x100):
             if self.check[idx] == s:
                 conflict_indices.append(idx)
                 conflict_points.append(idx - cur_base)
@@ -169,7 +361,7 @@ class DoubleArray:
         # for idx, check in enumerate(self.check):
         #     if check == s:
         #         conflict_indices.append(idx)
-        #         conflict_points.append(idx - abs(self.base[s]))
+        #         conflict_points.append(idx - self.base[s])
 
         return conflict_indices, conflict_points
 
@@ -187,7 +379,12 @@ class DoubleArray:
             valid position
         """
         x = self.start_point
-        while not self._is_placeable(x, points):
+        while True:
+            # keep room for any byte from the base x
+            if x + 0x100 > len(self.check):
+                self.extend_array(self.block_size)
+            if self._is_placeable(x, points):
+                break
             x += 1
         self.start_point = x
         return x
@@ -214,7 +411,7 @@ class DoubleArray:
     # @profile
     def _resolve_confliction(self, s, x, indices, points):
         # update the conflicted base
-        self.base[s] = -x if self.base[s] < 0 else x
+        self.base[s] = x
 
         # 新しい遷移先のcheckを更新する
         for p in points:
@@ -226,11 +423,11 @@ class DoubleArray:
 
             # 元遷移先からさらに遷移するノードのcheckをつけかえる
             # 競合した文字ごとに行う
-            if self.base[idx] == FLAGS.END:
+            if self.base[idx] < 0:  # leaf or tail node
                 continue
             else:
-                cur_base = abs(self.base[idx])
-                for i in range(cur_base, cur_base + 0x1FF):
+                cur_base = self.base[idx]
+                for i in range(cur_base, cur_base + 0x100):
                     if self.check[i] == idx:
                         self.check[i] = x + p
 
@@ -246,44 +443,264 @@ class DoubleArray:
 
         return
 
-    def build(self, vocabularies):
-        for vocab in tqdm(vocabularies):
-            self.insert(vocab.encode("utf-8"))
+    def build(self, vocabularies, values=None, bulk=True, tail=False):
+        """
+        build double array from vocabularies
+        Parameters
+        ----------
+        vocabularies : [str]
+            vocabularies to be indexed
+        values : [int]
+            non-negative value of each vocabulary (index in vocabularies by default)
+        bulk : bool
+            place the children of each node at once (build_bulk)
+            instead of inserting vocabularies one by one
+        tail : bool
+            use the TAIL layout (bulk only)
+        """
+        if values is None:
+            values = range(len(vocabularies))
+
+        if bulk:
+            self.build_bulk(vocabularies, values, tail)
+            return
+
+        for vocab, value in tqdm(zip(vocabularies, values), total=len(vocabularies)):
+            self.insert(vocab.encode("utf-8"), value)
+
+    def build_bulk(self, vocabularies, values=None, tail=False):
+        """
+        build double array breadth-first from the sorted vocabularies
+        Every child set is placed at once, so no relocation is needed,
+        and the free cells are tracked by a linked list to find a base quickly.
+        Parameters
+        ----------
+        vocabularies : [str]
+            vocabularies to be indexed
+        values : [int]
+            non-negative value of each vocabulary (index in vocabularies by default)
+        tail : bool
+            move the single-key suffixes into tail (TAIL layout)
+        """
+        if values is None:
+            values = range(len(vocabularies))
+        # the value inserted last wins for duplicated vocabularies, as with insert
+        key_values = {}
+        for vocab, value in zip(vocabularies, values):
+            key = vocab.encode("utf-8")
+            assert value >= 0
+            assert TERMINAL not in key
+            key_values[key] = value
+        keys = sorted(key_values)
+
+        self.base = [FLAGS.UNUSED] * self.block_size
+        self.check = [FLAGS.UNUSED] * self.block_size
+        self.mmap_path = None
+        self._clear_tail()
+        if len(keys) == 0:
+            return
+        tail_bytes = bytearray()
+
+        # cells below 0x100 can hardly be a first child since base must be positive,
+        # so they are not visited (but still can be used by the other children)
+        self._free_list = FreeList(self.block_size)
+        for idx in range(0x100):
+            self._free_list.remove(idx)
+
+        # (node, range of keys sharing the prefix of the node, prefix length)
+        queue = [(1, 0, len(keys), 0)]
+        with tqdm(total=len(keys)) as pbar:
+            for s, lo, hi, depth in queue:
+                if tail and hi - lo == 1 and s != 1:
+                    # the rest of the only key goes to tail
+                    tail_bytes += keys[lo][depth:]
+                    self.tail_offsets.append(len(tail_bytes))
+                    self.tail_values.append(key_values[keys[lo]])
+                    self.base[s] = -len(self.tail_values)
+                    pbar.update(1)
+                    continue
+
+                # the key ending at this node becomes the leaf of TERMINAL,
+                # which is the first child since TERMINAL is the smallest byte
+                points = []
+                ranges = []
+                is_terminal = len(keys[lo]) == depth
+                if is_terminal:
+                    points.append(TERMINAL)
+                    ranges.append((lo, lo + 1))
+                    lo += 1
+                    pbar.update(1)
+
+                # group keys by the byte following the prefix
+                begin = lo
+                for idx in range(lo + 1, hi + 1):
+                    if idx == hi or keys[idx][depth] != keys[begin][depth]:
+                        points.append(keys[begin][depth])
+                        ranges.append((begin, idx))
+                        begin = idx
+
+                x = self._search_free_position(points)
+                self.base[s] = x
+                for p, (child_lo, child_hi) in zip(points, ranges):
+                    self.check[x + p] = s
+                    self._free_list.remove(x + p)
+                    if p == TERMINAL:
+                        self.base[x + p] = -key_values[keys[child_lo]] - 1
+                    else:
+                        queue.append((x + p, child_lo, child_hi, depth + 1))
+
+        # keep enough margin to look up any byte from the rightmost base,
+        # and drop the unused cells after it
+        max_base = max(self.base)
+        last_used = max(idx for idx, c in enumerate(self.check) if c != FLAGS.UNUSED)
+        size = max(max_base + 0x100, last_used + 1)
+        if size > len(self.base):
+            self.extend_array(size - len(self.base))
+        del self.base[size:]
+        del self.check[size:]
+        self.tail = bytes(tail_bytes)
+        del self._free_list
+
+    def _search_free_position(self, points):
+        """
+        search for a base where all the points can be placed,
+        visiting unused cells only
+        Parameters
+        ----------
+        points : [int]
+            sorted part of code point to be placed
+        Return
+        ------
+        x : int
+            valid position
+        """
+        free_list = self._free_list
+        check = self.check
+        first = points[0]
+        offsets = [p - first for p in points[1:]]
+        last = points[-1] - first
+
+        idx = free_list.head
+        n_visited = 0
+        while True:
+            if idx == -1:
+                idx = len(check)
+                self.extend_array(self.block_size)
+                free_list.extend(self.block_size)
+                check = self.check
+
+            if idx + last >= len(check):
+                self.extend_array(self.block_size)
+                free_list.extend(self.block_size)
+                check = self.check
+
+            for o in offsets:
+                if check[idx + o] != FLAGS.UNUSED:
+                    break
+            else:
+                # the cells near head are nearly full : do not visit them any more
+                if n_visited > self.MAX_VISITED_FREE_CELLS:
+                    free_list.head_from(idx)
+                return idx - first
+
+            idx = free_list.next[idx]
+            n_visited += 1
 
     def save(self, filepath):
         """
-        save double array
+        save double array in the versioned binary format
         Parameters
         ----------
         filepath : str
             filepath
         """
-        with open(filepath, mode="w") as f:
-            line_base = ",".join(map(str, self.base))
-            line_check = ",".join(map(str, self.check))
-            f.write(line_base)
-            f.write("\n")
-            f.write(line_check)
-
-    def load(self, filepath):
+        arrays = [
+            array("i", self.base),
+            array("i", self.check),
+            array("i", self.tail_offsets),
+            array("i", self.tail_values),
+        ]
+        if sys.byteorder != "little":
+            for a in arrays:
+                a.byteswap()
+
+        with open(filepath, mode="wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.base)))
+            f.write(TAIL_HEADER.pack(len(self.tail_values), len(self.tail)))
+            for a in arrays:
+                a.tofile(f)
+            f.write(self.tail)
+
+    def load(self, filepath, use_mmap=True):
         """
         load double array
         Parameters
         ----------
         filepath : str
             filepath
+        use_mmap : bool
+            map the binary format into memory instead of reading it
+        Raises
+        ------
+        FileNotFoundError
+            filepath does not exist
+        ValueError
+            filepath is not a double array of a supported version
         """
         if not os.path.isfile(filepath):
-            print("File open error: {} not found".format(filepath))
-            return
+            raise FileNotFoundError("{} not found".format(filepath))
 
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-
-            if len(lines) != 2:
-                print("Format error: ")
-                return
-
-            self.base = [int(x) for x in lines[0].split(",")]
-            self.check = [int(x) for x in lines[1].split(",")]
+        with open(filepath, "rb") as f:
+            magic = f.read(len(MAGIC))
 
+        if magic == MAGIC:
+            self._load_binary(filepath, use_mmap)
+        else:
+            # the old text format has no values
+            raise ValueError(
+                "{} is not a double array (rebuild it with build.py)".format(filepath)
+            )
+
+    def _load_binary(self, filepath, use_mmap):
+        with open(filepath, "rb") as f:
+            _, version, size = HEADER.unpack(f.read(HEADER.size))
+            if version not in SUPPORTED_VERSIONS:
+                raise ValueError(
+                    "{} has unsupported version {} (rebuild it with build.py)".format(
+                        filepath, version
+                    )
+                )
+            n_entries, n_tail_bytes = 0, 0
+            if version >= 3:
+                n_entries, n_tail_bytes = TAIL_HEADER.unpack(f.read(TAIL_HEADER.size))
+            # (name, typecode, length) of the sections
+            sections = [
+                ("base", "i", size),
+                ("check", "i", size),
+                ("tail_offsets", "i", n_entries + 1 if version >= 3 else 0),
+                ("tail_values", "i", n_entries),
+                ("tail", "B", n_tail_bytes),
+            ]
+
+            self._clear_tail()
+            if use_mmap and sys.byteorder == "little":
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mmap_path = filepath
+                view = memoryview(self._mmap)
+                pos = f.tell()
+                for name, typecode, length in sections:
+                    n_bytes = length * (4 if typecode == "i" else 1)
+                    if length > 0:
+                        setattr(self, name, view[pos : pos + n_bytes].cast(typecode))
+                    pos += n_bytes
+            else:
+                for name, typecode, length in sections:
+                    a = array(typecode)
+                    a.fromfile(f, length)
+                    if sys.byteorder != "little":
+                        a.byteswap()
+                    if length > 0:
+                        setattr(self, name, a)
+                self.base = self.base.tolist()
+                self.check = self.check.tolist()
+                self.tail = bytes(self.tail)
@@ -0,0 +1,39 @@
+import json
+
+
+TSV_HEADER = "表層型\t品詞\t品詞1\t原型\t発音\n"
+
+
+def features(comugi, token):
+    node = comugi.get_node(token)
+    return token.surface, node.pos, node.pos1, node.base, node.pronunciation
+
+
+def format_tsv(comugi, sentence, results):
+    lines = []
+    for tokens in results:
+        for t in tokens:
+            lines.append("\t".join(map(str, features(comugi, t))))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def format_jsonl(comugi, sentence, results):
+    keys = ("surface", "pos", "pos1", "base", "pronunciation")
+    paths = [
+        [dict(zip(keys, features(comugi, t))) for t in tokens[1:-1]]  # without BOS, EOS
+        for tokens in results
+    ]
+    obj = {"text": sentence, "tokens": paths[0] if len(paths) > 0 else []}
+    if len(paths) > 1:
+        obj["nbest"] = paths
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+def format_wakati(comugi, sentence, results):
+    return "".join(
+        " ".join(t.surface for t in tokens[1:-1]) + "\n" for tokens in results
+    )
+
+
+FORMATTERS = {"tsv": format_tsv, "jsonl": format_jsonl, "wakati": format_wakati}
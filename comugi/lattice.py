@@ -1,7 +1,43 @@
 import sys
 import heapq
+import itertools
+import queue
+import threading
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
 from copy import deepcopy, copy
 from functools import lru_cache
+import numpy as np
+
+
+BOS_SURFACE = "__BOS__"
+EOS_SURFACE = "__EOS__"
+
+
+class Token(namedtuple("Token", ["ptr", "begin", "length", "sentence", "offset"], defaults=(0,))):
+    """
+    Immutable result of tokenization
+    ptr is the vocabulary id (-1 : BOS, -2 : EOS), and begin, length locate the token in the
+    sentence (offset is the position of sentence in the whole document, see tokenize_stream).
+    Only ids and offsets are held : surface is sliced when accessed, and the features are
+    decoded by Comugi.get_node.
+    """
+
+    __slots__ = ()
+
+    @property
+    def surface(self):
+        if self.ptr < 0:
+            return BOS_SURFACE if self.ptr == -1 else EOS_SURFACE
+        begin = self.begin - self.offset
+        return self.sentence[begin : begin + self.length]
+
+    def __repr__(self):
+        return (
+            f"Token(surface={self.surface!r}, ptr={self.ptr}, begin={self.begin}, "
+            f"length={self.length})"
+        )
 
 
 class Vocab:
@@ -14,6 +50,22 @@ class Vocab:
         return self.surface
         # return f"{self.surface}, {self.min_prev.surface}"
 
+    @property
+    def pos(self):
+        return self.item["pos"]
+
+    @property
+    def pos1(self):
+        return self.item["pos1"]
+
+    @property
+    def base(self):
+        return self.item["base"]
+
+    @property
+    def pronunciation(self):
+        return self.item["pronunciation"]
+
     def get_lid(self):
         return self.item["lid"]
 
@@ -24,48 +76,266 @@ class Vocab:
         return self.item["em_cost"]
 
 
-class VocabContainer:
-    def __init__(self, vocab_list):
-        self.vocabs = tuple(vocab_list)
+class StringTable:
+    """
+    Interned strings packed into one utf-8 blob
+    Attributes
+    ----------
+    blob : bytes
+        concatenated utf-8 strings
+    offsets : array
+        offsets[i]:offsets[i + 1] is the i-th string in blob
+    """
+
+    def __init__(self, strings=()):
+        encoded = [s.encode("utf-8") for s in strings]
+        self.blob = b"".join(encoded)
+        self.offsets = array("i", [0])
+        pos = 0
+        for e in encoded:
+            pos += len(e)
+            self.offsets.append(pos)
+
+    def __len__(self):
+        return len(self.offsets) - 1
 
     def __getitem__(self, x):
-        return self.vocabs[x]
+        if x < 0:  # no value
+            return None
+        return str(self.blob[self.offsets[x] : self.offsets[x + 1]], "utf-8")
 
 
-class NodeContainer:
-    def __init__(self):
-        self.nodes = []
+class VocabView:
+    """
+    Lightweight view of one vocabulary in VocabContainer
+    It has the same interface as Vocab, and features are decoded only when accessed.
+    """
+
+    __slots__ = ("container", "idx")
+
+    def __init__(self, container, idx):
+        self.container = container
+        self.idx = idx
+
+    def __str__(self):
+        return self.surface
+
+    @property
+    def surface(self):
+        return self.container.strings[self.container.surface[self.idx]]
+
+    @property
+    def length(self):
+        return self.container.length[self.idx]
+
+    @property
+    def pos(self):
+        return self.container.strings[self.container.pos[self.idx]]
+
+    @property
+    def pos1(self):
+        return self.container.strings[self.container.pos1[self.idx]]
+
+    @property
+    def base(self):
+        return self.container.strings[self.container.base[self.idx]]
+
+    @property
+    def pronunciation(self):
+        return self.container.strings[self.container.pronunciation[self.idx]]
+
+    @property
+    def item(self):
+        c = self.container
+        idx = self.idx
+        return {
+            "surface": c.strings[c.surface[idx]],
+            "pos": c.strings[c.pos[idx]],
+            "pos1": c.strings[c.pos1[idx]],
+            "base": c.strings[c.base[idx]],
+            "known": bool(c.known[idx]),
+            "pronunciation": c.strings[c.pronunciation[idx]],
+            "lid": c.lid[idx],
+            "rid": c.rid[idx],
+            "em_cost": c.em_cost[idx],
+        }
+
+    def get_lid(self):
+        return self.container.lid[self.idx]
+
+    def get_rid(self):
+        return self.container.rid[self.idx]
+
+    def get_em_cost(self):
+        return self.container.em_cost[self.idx]
 
-    def __getitem__(self, x):
-        return self.nodes[x]
+
+class VocabContainer:
+    """
+    Vocabularies stored as parallel typed arrays
+    lid, rid, em_cost and length are numbers, and surface, pos, pos1, base and
+    pronunciation are indices to the shared string table (-1 means None).
+    """
+
+    STRING_COLUMNS = ("surface", "pos", "pos1", "base", "pronunciation")
+
+    def __init__(self, vocab_list=()):
+        self.strings = StringTable()
+        self.lid = array("H")
+        self.rid = array("H")
+        self.em_cost = array("i")
+        self.length = array("H")
+        self.known = array("b")
+        for column in self.STRING_COLUMNS:
+            setattr(self, column, array("i"))
+        self._max_length = None  # see max_length
+
+        items = [v.item if isinstance(v, (Vocab, VocabView)) else v for v in vocab_list]
+        if len(items) > 0:
+            self.extend(items)
+
+    @classmethod
+    def from_items(cls, items):
+        """build from a list of dict formatted by dict_loader.format_item"""
+        return cls(items)
+
+    def extend(self, items):
+        strings = [self.strings[i] for i in range(len(self.strings))]
+        index = {s: i for i, s in enumerate(strings)}
+
+        def intern(s):
+            if s is None:
+                return -1
+            idx = index.get(s)
+            if idx is None:
+                idx = index[s] = len(strings)
+                strings.append(s)
+            return idx
+
+        for item in items:
+            self.lid.append(item["lid"])
+            self.rid.append(item["rid"])
+            self.em_cost.append(item["em_cost"])
+            self.length.append(len(item["surface"]))
+            self.known.append(1 if item["known"] else 0)
+            for column in self.STRING_COLUMNS:
+                getattr(self, column).append(intern(item[column]))
+
+        self.strings = StringTable(strings)
+        self._max_length = None
+
+    def max_length(self):
+        """length of the longest vocabulary (computed once)"""
+        # containers pickled by older versions have no _max_length
+        if self.__dict__.get("_max_length") is None:
+            self._max_length = max(self.length, default=0)
+        return self._max_length
+
+    @classmethod
+    def concat(cls, containers):
+        """
+        join containers in order (e.g. chunks of a dictionary parsed in parallel)
+        Vocabulary ids follow the order of containers, and the string table is the same
+        as the one built from all the items at once.
+        """
+        result = cls()
+        strings = []
+        index = {}
+        for c in containers:
+            remap = array("i")
+            for i in range(len(c.strings)):
+                s = c.strings[i]
+                idx = index.get(s)
+                if idx is None:
+                    idx = index[s] = len(strings)
+                    strings.append(s)
+                remap.append(idx)
+
+            for column in ("lid", "rid", "em_cost", "length", "known"):
+                getattr(result, column).extend(getattr(c, column))
+            for column in cls.STRING_COLUMNS:
+                getattr(result, column).extend(
+                    -1 if i < 0 else remap[i] for i in getattr(c, column)
+                )
+
+        result.strings = StringTable(strings)
+        return result
 
     def __len__(self):
-        return len(self.nodes)
+        return len(self.lid)
+
+    def __getitem__(self, x):
+        return VocabView(self, x)
+
+
+class Lexicon:
+    """
+    Vocabulary ids of the keys of the double array and of the unknown word categories
+    The double array gives the index of a matched key, whose vocabulary ids are
+    ids[offsets[key] : offsets[key + 1]] (no lookup by surface).
+    Attributes
+    ----------
+    offsets : array
+        offsets of the ids of each key (number of keys + 1)
+    ids : array
+        vocabulary ids of all the keys
+    unk_ids : dict
+        char category name -> vocabulary ids of unknown words
+    """
+
+    def __init__(self, id_lists=(), unk_ids=None):
+        self.offsets = array("i", [0])
+        self.ids = array("i")
+        for id_list in id_lists:
+            self.ids.extend(id_list)
+            self.offsets.append(len(self.ids))
+        self.unk_ids = {
+            category: tuple(ids) for category, ids in (unk_ids or {}).items()
+        }
 
-    def add(self, vocab):
-        self.nodes.append(vocab)
-        return len(self.nodes)
+    def __len__(self):
+        return len(self.offsets) - 1
 
-    def clear(self):
-        self.nodes = []
+    def word_ids(self, key):
+        """vocabulary ids of the key-th key of the double array"""
+        return self.ids[self.offsets[key] : self.offsets[key + 1]]
 
 
 class NodePointer:
-    def __init__(self, ptr, lid=0, rid=0, em_cost=0, length=0, min_cost=sys.maxsize):
+    __slots__ = (
+        "ptr",
+        "em_cost",
+        "lid",
+        "rid",
+        "length",
+        "surface",
+        "min_prev",
+        "min_cost",
+    )
+
+    def __init__(
+        self, ptr, lid=0, rid=0, em_cost=0, length=0, min_cost=sys.maxsize, surface=None
+    ):
+        self.reset(ptr, lid, rid, em_cost, length, min_cost, surface)
+
+    def reset(
+        self, ptr, lid=0, rid=0, em_cost=0, length=0, min_cost=sys.maxsize, surface=None
+    ):
         self.ptr = ptr
 
         self.em_cost = em_cost
         self.lid = lid
         self.rid = rid
         self.length = length
+        self.surface = surface  # only BOS, EOS have it : tokens slice surfaces from the sentence
 
         self.min_prev = None
         self.min_cost = min_cost
 
-        self.next = None
-
     def copy(self):
-        r = NodePointer(self.ptr, self.lid, self.rid, self.em_cost, self.length, self.min_cost)
+        r = NodePointer(
+            self.ptr, self.lid, self.rid, self.em_cost, self.length, self.min_cost, self.surface
+        )
         r.min_prev = self.min_prev
         return r
 
@@ -74,25 +344,65 @@ class NodePointer:
 
 class CostManager:
     def __init__(self, matrix):
-        self.matrix = matrix
+        self.matrix = self.to_ndarray(matrix)
+        # zero-copy view for scalar lookups, much faster than indexing the ndarray
+        self._view = memoryview(self.matrix)
+        self.mmap_path = None  # .npy file when the matrix is memory-mapped
+
+    @classmethod
+    def load(cls, filepath):
+        """memory-map the matrix saved by save (no parse, and the pages are shared by processes)"""
+        cm = cls(np.load(filepath, mmap_mode="r"))
+        cm.mmap_path = str(filepath)
+        return cm
+
+    def save(self, filepath):
+        np.save(filepath, self.matrix, allow_pickle=False)
+
+    @staticmethod
+    def to_ndarray(matrix):
+        # dense int16 matrix when all the costs fit in, int32 otherwise
+        if (
+            isinstance(matrix, np.ndarray)
+            and matrix.dtype in (np.int16, np.int32)
+            and matrix.flags.c_contiguous
+        ):
+            return matrix  # already compact (e.g. memory-mapped), so it is not scanned or copied
+        matrix = np.ascontiguousarray(matrix)
+        if matrix.size == 0:
+            return matrix.astype(np.int16)
+        info = np.iinfo(np.int16)
+        if info.min <= matrix.min() and matrix.max() <= info.max:
+            return matrix.astype(np.int16, copy=False)
+        return matrix.astype(np.int32, copy=False)
 
     def get_emission_cost(self, node_ptr):
         return node_ptr.em_cost
 
     def get_transition_cost(self, lnode_ptr, rnode_ptr):
-        return self.matrix[lnode_ptr.lid][rnode_ptr.rid]
+        return self._view[lnode_ptr.lid, rnode_ptr.rid]
 
 
 class Lattice:
+    # below this number of (end node, begin node) pairs the plain loop is faster than numpy
+    VECTORIZE_THRESHOLD = 64
+    # default bound of the priority queue in N-best search
+    NBEST_MAX_HEAP_SIZE = 1 << 16
+
     def __init__(self):
-        self.node_container = NodeContainer()
+        # node arena reused across sentences : nodes[:n_nodes] are in use
+        self.nodes = []
+        self.n_nodes = 0
+        # begin_nodes[:length + 1] and end_nodes[:length + 1] are in use
         self.begin_nodes = [[]]
         self.end_nodes = [[]]
         self.sentence = ""
         self._length = 0
 
-        self.bos_node = None
-        self.eos_node = None
+        self.bos_node = NodePointer(ptr=-1, min_cost=0, surface=BOS_SURFACE)
+        self.eos_node = NodePointer(ptr=-2, surface=EOS_SURFACE)
+        # number of partial paths pushed by the last N-best search (see iter_nbest_path)
+        self.n_heap_pushes = 0
 
     # def debug(self):
     #     for i in range(self._length + 1):
@@ -108,110 +418,241 @@ class Lattice:
     #     pass
 
     def __len__(self):
-        return len(self.node_container)
+        return self.n_nodes
 
     def set_bos_node(self):
-        return NodePointer(ptr=-1, min_cost=0)
+        self.bos_node.reset(ptr=-1, min_cost=0, surface=BOS_SURFACE)
+        return self.bos_node
 
     def set_eos_node(self):
-        return NodePointer(ptr=-2)
+        self.eos_node.reset(ptr=-2, surface=EOS_SURFACE)
+        return self.eos_node
+
+    def set_sentence(self, sentence, context=None):
+        """
+        reset the lattice for sentence, reusing the node arena and the node lists
+        Nodes of the previous sentence (including paths returned by calc_path) are overwritten.
+        context is (lid, rid) given to BOS node when the sentence continues from the node
+        analyzed before it (see tokenize_stream).
+        """
+        for i in range(self._length + 1):
+            self.begin_nodes[i].clear()
+            self.end_nodes[i].clear()
+        self.n_nodes = 0
 
-    def set_sentence(self, sentence):
         self.sentence = sentence
         self._length = len(sentence)
 
-        self.node_container.clear()
-        self.begin_nodes = [[] for _ in range(self._length + 1)]
-        self.end_nodes = [[] for _ in range(self._length + 1)]
+        n_lists = len(self.begin_nodes)
+        if n_lists < self._length + 1:
+            self.begin_nodes.extend([] for _ in range(self._length + 1 - n_lists))
+            self.end_nodes.extend([] for _ in range(self._length + 1 - n_lists))
 
         # insert bos, eos node
-        self.bos_node = self.set_bos_node()
-        self.eos_node = self.set_eos_node()
-        self.end_nodes[0].append(self.bos_node)
-        self.begin_nodes[self._length].append(self.eos_node)
-
-    def add_node(self, node):
-        self.node_container.add(node)
+        bos_node = self.set_bos_node()
+        if context is not None:
+            bos_node.lid, bos_node.rid = context
+        self.end_nodes[0].append(bos_node)
+        self.begin_nodes[self._length].append(self.set_eos_node())
+
+    def new_node(self, begin, ptr, lid, rid, em_cost, length, surface=None):
+        """insert a node taken from the arena"""
+        if self.n_nodes < len(self.nodes):
+            node_ptr = self.nodes[self.n_nodes]
+            node_ptr.reset(ptr, lid, rid, em_cost, length, surface=surface)
+        else:
+            node_ptr = NodePointer(ptr, lid, rid, em_cost, length, surface=surface)
+            self.nodes.append(node_ptr)
+        self.n_nodes += 1
 
-    def insert(self, begin, node_ptr, node, length):
-        # append vocab in use
-        self.add_node(node)
+        self.begin_nodes[begin].append(node_ptr)
+        self.end_nodes[begin + length].append(node_ptr)
+        return node_ptr
 
-        # insert node pointer to node in use
+    def insert(self, begin, node_ptr, node=None, length=None):
+        """insert a node created outside the arena"""
+        if length is None:
+            length = node_ptr.length
         self.begin_nodes[begin].append(node_ptr)
         end = begin + length
         self.end_nodes[end].append(node_ptr)
         return node_ptr
 
     def calc_forward_cost(self, cm):
-        for (begin_nodes, end_nodes) in zip(self.begin_nodes, self.end_nodes):
-            for rnode in begin_nodes:
-                rnode_em_cost = rnode.em_cost
-                for lnode in end_nodes:
-                    trans_cost = cm.get_transition_cost(lnode, rnode)
-                    cost = lnode.min_cost + rnode_em_cost + trans_cost
-                    if cost < rnode.min_cost:
-                        rnode.min_cost = cost
-                        rnode.min_prev = lnode
+        matrix = cm.matrix
+        for pos in range(self._length + 1):
+            begin_nodes = self.begin_nodes[pos]
+            end_nodes = self.end_nodes[pos]
+            if len(begin_nodes) == 0:
+                continue
+
+            # nodes which could not be reached from BOS are left out
+            end_nodes = [n for n in end_nodes if n.min_cost != sys.maxsize]
+            if len(end_nodes) == 0:
+                continue
+
+            n_left = len(end_nodes)
+            n_right = len(begin_nodes)
+            if n_left * n_right < self.VECTORIZE_THRESHOLD:
+                for rnode in begin_nodes:
+                    rnode_em_cost = rnode.em_cost
+                    for lnode in end_nodes:
+                        trans_cost = cm.get_transition_cost(lnode, rnode)
+                        cost = lnode.min_cost + rnode_em_cost + trans_cost
+                        if cost < rnode.min_cost:
+                            rnode.min_cost = cost
+                            rnode.min_prev = lnode
+                continue
+
+            lids = np.fromiter((n.lid for n in end_nodes), np.intp, n_left)
+            lcosts = np.fromiter((n.min_cost for n in end_nodes), np.int64, n_left)
+            rids = np.fromiter((n.rid for n in begin_nodes), np.intp, n_right)
+            em_costs = np.fromiter((n.em_cost for n in begin_nodes), np.int64, n_right)
+
+            # min-plus step : cost[l, r] = min_cost[l] + trans[l, r] + em_cost[r]
+            # argmin keeps the first minimum as the scalar loop with "<" did
+            costs = lcosts[:, None] + matrix[np.ix_(lids, rids)] + em_costs[None, :]
+            best = costs.argmin(axis=0)
+            min_costs = costs[best, np.arange(n_right)].tolist()
+
+            for rnode, b, cost in zip(begin_nodes, best.tolist(), min_costs):
+                if cost < rnode.min_cost:
+                    rnode.min_cost = cost
+                    rnode.min_prev = end_nodes[b]
 
     def get_best_path(self):
-        e = self.begin_nodes[self._length][0]  # EOS node
+        return [self.backtrack(self.begin_nodes[self._length][0])]  # from EOS node
+
+    def backtrack(self, e):
+        """best path from BOS node to the node e"""
         best_path = [e]
         while e.min_prev != None:
             best_path.append(e.min_prev)
             e = e.min_prev
 
-        return [best_path[::-1]]
-
-    def get_nbest_path(self, cm, n_best):
-        e = self.begin_nodes[self._length][0]  # EOS node
-        q = [
-            (0, 0, self._length, id(e), e)
-        ]  # tuple means (priority, backward_cost, current position, id, node)
-        count = 0
-
-        n_best_path = []
+        return best_path[::-1]
+
+    def iter_nbest_path(self, cm, max_heap_size=None, count_pushes=False):
+        """
+        yield paths lazily in ascending order of cost (A* search from EOS)
+        Forward min_cost is the exact heuristic, so calc_forward_cost must be called before.
+        Partial paths share their tails through links (node, begin position, next link)
+        instead of copying nodes.
+        Parameters
+        ----------
+        cm : CostManager
+            cost manager
+        max_heap_size : int
+            number of partial paths kept in the queue (NBEST_MAX_HEAP_SIZE if None)
+            The worst ones are dropped beyond this, so deep results may be approximate.
+        count_pushes : bool
+            set n_heap_pushes to the number of partial paths pushed until each yielded path
+        """
+        if max_heap_size is None:
+            max_heap_size = self.NBEST_MAX_HEAP_SIZE
+
+        eos = self.eos_node
+        if count_pushes:
+            self.n_heap_pushes = 0
+        if eos.min_cost == sys.maxsize:
+            return
+
+        # (priority, backward cost, sequence number for ties, link)
+        counter = itertools.count()
+        q = [(eos.min_cost, 0, next(counter), (eos, self._length, None))]
+        n_pushes = 1
         while len(q) != 0:
-            _, cost, cur_pos, _, node = heapq.heappop(q)
-            if node.min_prev == None:  # reach BOS node
+            _, backward_cost, _, link = heapq.heappop(q)
+            node, cur_pos, _ = link
+
+            if node is self.bos_node:
+                if count_pushes:
+                    self.n_heap_pushes = n_pushes
                 path = []
-                while node.next is not None:
-                    path.append(node)
-                    node = node.next
-                n_best_path.append(path)
-                count += 1
-                if count == n_best:
-                    break
-            else:
-                for lnode in self.end_nodes[cur_pos]:
-                    backward_cost = (
-                        cost + cm.get_transition_cost(lnode, node) + lnode.em_cost
-                    )
-                    forward_cost = lnode.min_cost
-                    priority = forward_cost + backward_cost
-
-                    tmp_lnode = lnode.copy()
-
-                    heapq.heappush(
-                        q,
-                        (
-                            priority,
-                            backward_cost,
-                            cur_pos - lnode.length,
-                            id(tmp_lnode),
-                            tmp_lnode,
-                        ),
-                    )
-
-                    if len(q) % 10000 == 0:
-                        print(len(q), sys.getsizeof(q))
-
-        return n_best_path
-
-    def calc_path(self, cm, best_n):
+                while link is not None:
+                    path.append(link[0])
+                    link = link[2]
+                yield path
+                continue
+
+            rnode_cost = backward_cost + node.em_cost
+            for lnode in self.end_nodes[cur_pos]:
+                if lnode.min_cost == sys.maxsize:  # not reachable from BOS
+                    continue
+                cost = rnode_cost + cm.get_transition_cost(lnode, node)
+                heapq.heappush(
+                    q,
+                    (
+                        lnode.min_cost + cost,
+                        cost,
+                        next(counter),
+                        (lnode, cur_pos - lnode.length, link),
+                    ),
+                )
+                n_pushes += 1
+
+            if len(q) > 2 * max_heap_size:
+                q = heapq.nsmallest(max_heap_size, q)  # a sorted list is a heap
+
+    def get_nbest_path(self, cm, n_best, max_heap_size=None, count_pushes=False):
+        return list(
+            itertools.islice(self.iter_nbest_path(cm, max_heap_size, count_pushes), n_best)
+        )
+
+    def to_tokens(self, path, offset=0):
+        tokens = []
+        begin = offset
+        sentence = self.sentence
+        for node in path:
+            tokens.append(Token(node.ptr, begin, node.length, sentence, offset))
+            begin += node.length
+        return tokens
+
+    def calc_path(self, cm, best_n, max_heap_size=None):
         self.calc_forward_cost(cm)
 
         if best_n == 1:
             return self.get_best_path()
         else:
-            return self.get_nbest_path(cm, best_n)
+            return self.get_nbest_path(cm, best_n, max_heap_size)
+
+
+class LatticePool:
+    """
+    Bounded pool of lattices
+    Each tokenization borrows its own lattice, so that one Comugi can be shared by threads.
+    Attributes
+    ----------
+    max_size : int
+        maximum number of lattices (borrowers wait when all of them are in use)
+    """
+
+    def __init__(self, max_size=8):
+        assert max_size >= 1
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._size < self.max_size:
+                self._size += 1
+                return Lattice()
+        return self._idle.get()
+
+    def release(self, lattice):
+        self._idle.put(lattice)
+
+    @contextmanager
+    def lattice(self):
+        lattice = self.acquire()
+        try:
+            yield lattice
+        finally:
+            self.release(lattice)
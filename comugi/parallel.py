@@ -0,0 +1,203 @@
+import multiprocessing as mp
+import os
+from array import array
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+from .double_array import DoubleArray
+from .lattice import CostManager, Lexicon, StringTable, VocabContainer
+
+
+ALIGNMENT = 8
+
+
+class SharedDictionary:
+    """
+    Handle of dictionaries placed in one shared memory block
+    Arrays (double array, lexicon, connection matrix, vocabulary columns and string table)
+    are copied into shared memory once, and workers attach them without copy.
+    The double array and the matrix are not copied when they are already memory-mapped
+    from files.
+    Small python objects (unknown word ids, char category tables) are inherited by fork
+    (or pickled once per worker with the other start methods).
+    Nothing is copied for a dictionary bundle : workers memory-map the same file.
+    The user dictionary (if any) is passed as a python object.
+    """
+
+    def __init__(self, comugi):
+        self.cls = type(comugi)
+        self.user_dictionary = comugi.user_dictionary
+
+        # a bundle is memory-mapped again by workers
+        self.bundle_path = comugi.bundle.path if comugi.bundle is not None else None
+        self._shm = None
+        if self.bundle_path is not None:
+            return
+
+        self.unk_ids = comugi.lexicon.unk_ids
+        self.char_category_table = comugi.char_category_table
+        self.char_category_policy = comugi.char_category_policy
+
+        buffers = {}
+        da = comugi.da
+        self.da_path = da.mmap_path
+        if self.da_path is None:
+            buffers["da.base"] = array("i", da.base)
+            buffers["da.check"] = array("i", da.check)
+            buffers["da.tail"] = da.tail
+            buffers["da.tail_offsets"] = da.tail_offsets
+            buffers["da.tail_values"] = da.tail_values
+        buffers["lexicon.offsets"] = comugi.lexicon.offsets
+        buffers["lexicon.ids"] = comugi.lexicon.ids
+
+        matrix = comugi.cost_manager.matrix
+        self.matrix_path = comugi.cost_manager.mmap_path
+        self.matrix_dtype = matrix.dtype.str
+        self.matrix_shape = matrix.shape
+        if self.matrix_path is None:
+            buffers["matrix"] = matrix
+
+        vc = comugi.vocab_container
+        for column in ("lid", "rid", "em_cost", "length", "known") + vc.STRING_COLUMNS:
+            buffers[f"vocab.{column}"] = getattr(vc, column)
+        buffers["strings.blob"] = vc.strings.blob
+        buffers["strings.offsets"] = vc.strings.offsets
+
+        # manifest : name -> (offset, number of bytes, format)
+        self.manifest = {}
+        size = 0
+        for name, buf in buffers.items():
+            view = memoryview(buf)
+            self.manifest[name] = (size, view.nbytes, view.format)
+            size += (view.nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.name = self._shm.name
+        for name, buf in buffers.items():
+            offset, nbytes, _ = self.manifest[name]
+            self._shm.buf[offset : offset + nbytes] = memoryview(buf).cast("B")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_shm"]
+        return state
+
+    def _view(self, shm, name):
+        offset, nbytes, fmt = self.manifest[name]
+        return shm.buf[offset : offset + nbytes].cast(fmt)
+
+    def attach(self, max_lattices=1):
+        """create Comugi backed by the shared memory (called in workers)"""
+        if self.bundle_path is not None:
+            comugi = self.cls.from_bundle(self.bundle_path, max_lattices)
+            comugi.user_dictionary = self.user_dictionary
+            return comugi
+
+        shm = attach_shared_memory(self.name)
+
+        da = DoubleArray()
+        if self.da_path is not None:
+            da.load(self.da_path)
+        else:
+            da.base = self._view(shm, "da.base")
+            da.check = self._view(shm, "da.check")
+            da.tail = self._view(shm, "da.tail")
+            da.tail_offsets = self._view(shm, "da.tail_offsets")
+            da.tail_values = self._view(shm, "da.tail_values")
+
+        lexicon = Lexicon()
+        lexicon.offsets = self._view(shm, "lexicon.offsets")
+        lexicon.ids = self._view(shm, "lexicon.ids")
+        lexicon.unk_ids = self.unk_ids
+
+        if self.matrix_path is not None:
+            cost_manager = CostManager.load(self.matrix_path)
+        else:
+            offset, nbytes, _ = self.manifest["matrix"]
+            matrix = np.ndarray(
+                self.matrix_shape, dtype=self.matrix_dtype, buffer=shm.buf, offset=offset
+            )
+            cost_manager = CostManager(matrix)
+
+        vc = VocabContainer()
+        for column in ("lid", "rid", "em_cost", "length", "known") + vc.STRING_COLUMNS:
+            setattr(vc, column, self._view(shm, f"vocab.{column}"))
+        strings = StringTable()
+        strings.blob = self._view(shm, "strings.blob")
+        strings.offsets = self._view(shm, "strings.offsets")
+        vc.strings = strings
+
+        comugi = self.cls.from_parts(
+            da,
+            lexicon,
+            vc,
+            cost_manager,
+            self.char_category_table,
+            self.char_category_policy,
+            max_lattices,
+        )
+        comugi.user_dictionary = self.user_dictionary
+        comugi._shm = shm  # keep the block mapped as long as comugi lives
+        return comugi
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._shm.close()
+        self._shm.unlink()
+
+
+def attach_shared_memory(name):
+    try:
+        # python >= 3.13 : the block is owned (and unlinked) by the parent
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # pool workers share the resource tracker of the parent, so registering again is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+_worker_comugi = None
+
+
+def _init_worker(handle):
+    global _worker_comugi
+    _worker_comugi = handle.attach()
+
+
+def _tokenize_chunk(sentences, best_n):
+    return [_worker_comugi.tokenize(s, best_n) for s in sentences]
+
+
+def _chunks(sentences, chunksize):
+    chunk = []
+    for s in sentences:
+        chunk.append(s)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def tokenize_many(comugi, sentences, best_n=1, processes=None, chunksize=64):
+    """
+    tokenize sentences with a process pool, yielding results in the input order
+    Only a bounded number of chunks are in flight, so sentences may be a lazy
+    iterable over a large corpus.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    max_in_flight = processes * 4
+
+    handle = SharedDictionary(comugi)
+    try:
+        with mp.Pool(processes, initializer=_init_worker, initargs=(handle,)) as pool:
+            pending = deque()
+            for chunk in _chunks(sentences, chunksize):
+                pending.append(pool.apply_async(_tokenize_chunk, (chunk, best_n)))
+                if len(pending) >= max_in_flight:
+                    yield from pending.popleft().get()
+            while len(pending) > 0:
+                yield from pending.popleft().get()
+    finally:
+        handle.close()
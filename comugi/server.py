@@ -0,0 +1,218 @@
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from itertools import islice
+from .formatter import FORMATTERS
+
+
+# frame : number of bytes of the payload (uint32, big endian) | payload
+# request : number of sentences | N of N-best | format | sentences in utf-8 joined by "\n"
+# response : status | outputs of the formatter for the sentences in utf-8
+#            (an error message if status is not STATUS_OK)
+FRAME = struct.Struct("!I")
+REQUEST = struct.Struct("!IHB")
+RESPONSE = struct.Struct("!B")
+FORMATS = tuple(FORMATTERS)  # format of a request is an index of FORMATS
+STATUS_OK = 0
+STATUS_ERROR = 1
+MAX_FRAME_SIZE = 1 << 28
+BATCH_SIZE = 256
+
+
+class ServerError(Exception):
+    pass
+
+
+def _recv_exact(sock, n):
+    """n bytes from sock, or None if the connection is closed before the first byte"""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        k = sock.recv_into(view[pos:])
+        if k == 0:
+            if pos == 0:
+                return None
+            raise ConnectionError("connection closed in the middle of a frame")
+        pos += k
+    return buf
+
+
+def recv_frame(sock):
+    """payload of the next frame, or None at the end of the connection"""
+    header = _recv_exact(sock, FRAME.size)
+    if header is None:
+        return None
+    (size,) = FRAME.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError(f"frame of {size} bytes is too large")
+    if size == 0:
+        return b""
+    payload = _recv_exact(sock, size)
+    if payload is None:
+        raise ConnectionError("connection closed in the middle of a frame")
+    return payload
+
+
+def send_frame(sock, *parts):
+    payload = b"".join(parts)
+    sock.sendall(FRAME.pack(len(payload)) + payload)
+
+
+def _remove_stale_socket(path):
+    """remove the socket file left by a server which is not running"""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise OSError(f"{path} is served by another process")
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                payload = recv_frame(self.request)
+            except ConnectionError:
+                return
+            if payload is None:
+                return
+
+            try:
+                output = self.server.process(payload)
+                status = STATUS_OK
+            except Exception as e:
+                output = f"{type(e).__name__}: {e}"
+                status = STATUS_ERROR
+
+            try:
+                send_frame(self.request, RESPONSE.pack(status), output.encode())
+            except (BrokenPipeError, ConnectionError):
+                return
+
+
+class ComugiServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Tokenizer daemon on a unix domain socket
+    The dictionaries are loaded once by the caller, and each connection is served by
+    its own thread (the threads share comugi with its lattice pool).
+    A connection sends any number of requests, each of which is a batch of sentences.
+    Attributes
+    ----------
+    comugi : Comugi
+        tokenizer
+    path : str
+        path of the socket (readable and writable by the owner only)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, comugi, path):
+        self.comugi = comugi
+        self.path = str(path)
+        _remove_stale_socket(self.path)
+        super().__init__(self.path, _RequestHandler)
+
+    def server_bind(self):
+        super().server_bind()
+        os.chmod(self.path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def process(self, payload):
+        """formatted outputs for a request"""
+        n_sentences, best_n, fmt = REQUEST.unpack_from(payload)
+        formatter = FORMATTERS[FORMATS[fmt]]
+        text = bytes(payload[REQUEST.size :]).decode("utf-8")
+        sentences = text.split("\n") if n_sentences > 0 else []
+        if len(sentences) != n_sentences:
+            raise ValueError(
+                f"request has {len(sentences)} sentences, but {n_sentences} are declared"
+            )
+        return "".join(
+            formatter(self.comugi, sentence, self.comugi.tokenize(sentence, best_n))
+            for sentence in sentences
+        )
+
+
+def serve(comugi, path):
+    """serve comugi on path until the process is interrupted or terminated"""
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with ComugiServer(comugi, path) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class ComugiClient:
+    """
+    Client of ComugiServer
+    The output for a sentence is the same as that of the formatters of Comugi
+    (see main.py), without loading the dictionaries.
+    """
+
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(str(path))
+        except OSError:
+            self.sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def tokenize_batch(self, sentences, best_n=1, fmt="tsv"):
+        """formatted output for sentences (one request)"""
+        sentences = list(sentences)
+        if any("\n" in sentence for sentence in sentences):
+            raise ValueError("sentence must not contain a newline")
+        send_frame(
+            self.sock,
+            REQUEST.pack(len(sentences), best_n, FORMATS.index(fmt)),
+            "\n".join(sentences).encode("utf-8"),
+        )
+
+        response = recv_frame(self.sock)
+        if response is None:
+            raise ConnectionError("server closed the connection")
+        (status,) = RESPONSE.unpack_from(response)
+        output = bytes(response[RESPONSE.size :]).decode("utf-8")
+        if status != STATUS_OK:
+            raise ServerError(output)
+        return output
+
+    def tokenize_lines(self, lines, best_n=1, fmt="tsv", batch_size=BATCH_SIZE):
+        """formatted outputs for every batch_size lines"""
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, batch_size))
+            if len(batch) == 0:
+                return
+            yield self.tokenize_batch(batch, best_n, fmt)
@@ -0,0 +1,115 @@
+import sys
+import threading
+from time import perf_counter
+
+
+class TokenizeStats:
+    """
+    Cumulative profile of the tokenization pipeline (see Comugi.enable_stats)
+    Attributes
+    ----------
+    times : dict
+        wall time in seconds of each phase
+        unknown_words and dictionary_search are parts of build_lattice.
+    counters : dict
+        number of sentences, characters, lattice nodes and edges, nodes of known words
+        (dictionary_hits) and unknown words, and pushes to the N-best queue
+    """
+
+    PHASES = (
+        "char_category",
+        "build_lattice",
+        "unknown_words",
+        "dictionary_search",
+        "forward",
+        "backtrack",
+        "nbest",
+    )
+    COUNTERS = (
+        "sentences",
+        "characters",
+        "nodes",
+        "edges",
+        "dictionary_hits",
+        "unknown_words",
+        "heap_pushes",
+    )
+    # phases measured inside build_lattice
+    SUB_PHASES = ("unknown_words", "dictionary_search")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.times = dict.fromkeys(self.PHASES, 0.0)
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def lap(self, phase, start):
+        """add the time from start to phase, and return the current time"""
+        now = perf_counter()
+        with self._lock:
+            self.times[phase] += now - start
+        return now
+
+    def timed(self, phase, func):
+        """func whose calls are added to phase"""
+
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.lap(phase, start)
+
+        return wrapper
+
+    def add(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                self.counters[name] += n
+
+    def count_lattice(self, lattice, vocab_container):
+        """count nodes and edges of lattice after the forward pass"""
+        known = vocab_container.known
+        n_vocab = len(known)
+        nodes = lattice.nodes[: lattice.n_nodes]
+        # ids beyond the system vocabulary are user words
+        hits = sum(known[node.ptr] if node.ptr < n_vocab else 1 for node in nodes)
+        edges = 0
+        for pos in range(len(lattice.sentence) + 1):
+            n_left = sum(n.min_cost != sys.maxsize for n in lattice.end_nodes[pos])
+            edges += n_left * len(lattice.begin_nodes[pos])
+        self.add(
+            sentences=1,
+            characters=len(lattice.sentence),
+            nodes=len(nodes),
+            edges=edges,
+            dictionary_hits=hits,
+            unknown_words=len(nodes) - hits,
+        )
+
+    def as_dict(self):
+        with self._lock:
+            return {"times": dict(self.times), "counters": dict(self.counters)}
+
+    def report(self):
+        """human readable summary"""
+        stats = self.as_dict()
+        times = stats["times"]
+        counters = stats["counters"]
+        total = sum(t for phase, t in times.items() if phase not in self.SUB_PHASES)
+        n = max(counters["sentences"], 1)
+
+        lines = [f"{'phase':<20}{'sec':>10}{'%':>8}{'us/sent':>12}"]
+        for phase in self.PHASES:
+            t = times[phase]
+            ratio = 100 * t / total if total > 0 else 0.0
+            name = phase if phase not in self.SUB_PHASES else f"  ({phase})"
+            lines.append(f"{name:<20}{t:>10.3f}{ratio:>8.1f}{1e6 * t / n:>12.1f}")
+        lines.append(f"{'total':<20}{total:>10.3f}")
+        lines.append("")
+        for name in self.COUNTERS:
+            lines.append(f"{name:<20}{counters[name]:>10}")
+        return "\n".join(lines)
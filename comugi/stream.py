@@ -0,0 +1,119 @@
+import sys
+
+
+# forced cuts (when the best path is never determined) are made after these characters if possible
+SENTENCE_ENDS = frozenset("。．！？!?\n")
+
+
+def _find_cut(comugi, lattice, limit):
+    """
+    rightmost position p (0 < p <= limit) where the best path of the document is already determined
+    No reachable node crosses p, all the reachable nodes ending at p have the same left id
+    (so any node beginning at p prefers the same one of them), and the unknown words from p
+    are the same as in the whole document.
+    Returns (p, node ending at p on the best path) or None
+    """
+    begin_nodes = lattice.begin_nodes
+    end_nodes = lattice.end_nodes
+    sentence = lattice.sentence
+    table = comugi.char_category_table
+    policy = comugi.char_category_policy
+
+    cut = None
+    reach = 0  # furthest end of the reachable nodes beginning before p
+    for p in range(1, limit + 1):
+        for node in begin_nodes[p - 1]:
+            if node.min_cost != sys.maxsize and p - 1 + node.length > reach:
+                reach = p - 1 + node.length
+        if reach > p:
+            continue
+
+        # grouped unknown words never begin in the middle of a run of the same category
+        cat_name = table.lookup(sentence[p])
+        if policy[cat_name]["group"] == 1 and table.lookup(sentence[p - 1]) == cat_name:
+            continue
+
+        pivot = None
+        for node in end_nodes[p]:
+            if node.min_cost == sys.maxsize:
+                continue
+            if pivot is None:
+                pivot = node
+            elif node.lid != pivot.lid:
+                pivot = None
+                break
+            elif node.min_cost < pivot.min_cost:
+                pivot = node
+        if pivot is not None:
+            cut = (p, pivot)
+    return cut
+
+
+def _force_cut(lattice, limit):
+    """
+    cut after the last sentence end (or at the last possible position) before limit
+    When no node ends before limit (a word longer than the window), the first position after it.
+    """
+    candidates = []
+    positions = list(range(limit, 0, -1)) + list(range(limit + 1, len(lattice.sentence) + 1))
+    for p in positions:
+        nodes = [n for n in lattice.end_nodes[p] if n.min_cost != sys.maxsize]
+        if len(nodes) == 0:
+            continue
+        pivot = min(nodes, key=lambda n: n.min_cost)
+        if p <= limit and lattice.sentence[p - 1] in SENTENCE_ENDS:
+            return p, pivot
+        candidates.append((p, pivot))
+    return candidates[0]
+
+
+def _pieces(texts, size):
+    for text in texts:
+        for i in range(0, len(text), size):
+            yield text[i : i + size]
+
+
+def tokenize_stream(comugi, texts, chunk_size=4096):
+    """
+    tokenize a long document given as an iterable of texts, yielding tokens incrementally
+    The tokens are the same as tokenize(document)[0] (BOS first and EOS last) with the
+    offsets in the whole document, and a lattice never holds more than
+    chunk_size + (length of the longest word) characters.
+    The document is cut where the best path is already determined; only when such a
+    position does not exist in a window (e.g. a very long run of unknown characters),
+    it is cut after a sentence end and the result may differ around there.
+    """
+    assert chunk_size >= 1
+    cm = comugi.cost_manager
+    # words beginning before a cut must be seen entirely in the window
+    lookahead = max(comugi.vocab_container.max_length(), 1)
+    if comugi.user_dictionary is not None:
+        lookahead = max(lookahead, comugi.user_dictionary.max_length())
+    window_size = chunk_size + lookahead
+
+    buffer = ""
+    offset = 0  # offset of buffer in the document
+    context = None  # (lid, rid) of the node before buffer
+    with comugi.lattice_pool.lattice() as lattice:
+        for piece in _pieces(texts, chunk_size):
+            buffer += piece
+            while len(buffer) >= window_size:
+                comugi.set_lattice(buffer[:window_size], lattice, context)
+                lattice.calc_forward_cost(cm)
+                cut = _find_cut(comugi, lattice, chunk_size)
+                if cut is None:
+                    cut = _force_cut(lattice, chunk_size)
+                p, pivot = cut
+
+                path = lattice.backtrack(pivot)
+                tokens = lattice.to_tokens(path, offset)
+                yield from tokens if context is None else tokens[1:]
+
+                buffer = buffer[p:]
+                offset += p
+                context = (pivot.lid, pivot.rid)
+
+        comugi.set_lattice(buffer, lattice, context)
+        lattice.calc_forward_cost(cm)
+        tokens = lattice.to_tokens(lattice.get_best_path()[0], offset)
+        yield from tokens if context is None else tokens[1:]
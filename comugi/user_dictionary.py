@@ -0,0 +1,99 @@
+import csv
+import os
+import pickle
+from .double_array import DoubleArray
+from .lattice import VocabContainer
+
+
+# columns of a row of mecab format (ipadic layout) used by Comugi
+# surface, left id, right id, cost, pos, pos1, (pos2, pos3, conjugation type and form,)
+# base, (reading,) pronunciation
+N_COLUMNS = 13
+
+
+def format_row(row):
+    """vocabulary item of a row of a mecab format csv (same as dict_loader.format_item)"""
+    if len(row) < N_COLUMNS:
+        raise ValueError(f"user dictionary row needs {N_COLUMNS} columns : {row}")
+    if len(row[0]) == 0:
+        raise ValueError(f"user dictionary row has an empty surface : {row}")
+    return {
+        "surface": row[0],
+        "pos": row[4],
+        "pos1": row[5],
+        "base": row[10],
+        "known": True,
+        "pronunciation": row[12],
+        "lid": int(row[1]),
+        "rid": int(row[2]),
+        "em_cost": int(row[3]),
+    }
+
+
+def read_rows(path_or_entries, encoding="utf-8"):
+    """rows of a csv file, or the given rows"""
+    if isinstance(path_or_entries, (str, os.PathLike)):
+        with open(path_or_entries, "r", encoding=encoding, newline="") as f:
+            return [row for row in csv.reader(f) if len(row) > 0]
+    return [list(row) for row in path_or_entries]
+
+
+class UserDictionary:
+    """
+    Words added on top of the system dictionary without rebuilding it
+    Surfaces are inserted one by one into a small double array, and the vocabularies
+    are kept in their own VocabContainer. Vocabulary ids of user words follow the
+    ids of the system dictionary (id_offset + index in vocab_container).
+    Attributes
+    ----------
+    id_offset : int
+        number of vocabularies of the system dictionary
+    da : DoubleArray
+        surfaces of the user words (the value of a surface is an index of word_ids)
+    word_ids : [[int]]
+        vocabulary ids of each surface
+    vocab_container : VocabContainer
+        vocabularies of the user words
+    """
+
+    def __init__(self, id_offset):
+        self.id_offset = id_offset
+        self.da = DoubleArray()
+        self.word_ids = []
+        self.vocab_container = VocabContainer()
+
+    def __len__(self):
+        return len(self.vocab_container)
+
+    def add(self, items):
+        """add vocabulary items (formatted by format_row)"""
+        items = list(items)
+        idx = self.id_offset + len(self.vocab_container)
+        self.vocab_container.extend(items)
+
+        for item in items:
+            key = item["surface"].encode("utf-8")
+            value = self.da.lookup(key)
+            if value is None:
+                value = len(self.word_ids)
+                self.word_ids.append([])
+                self.da.insert(key, value)
+            self.word_ids[value].append(idx)
+            idx += 1
+
+    def max_length(self):
+        """length of the longest user word"""
+        return self.vocab_container.max_length()
+
+    def save(self, filepath):
+        """save in compiled form, which is loaded by load without parsing csv"""
+        with open(filepath, "wb") as f:
+            pickle.dump(self, f, protocol=4)
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, "rb") as f:
+            user_dictionary = pickle.load(f)
+        if not isinstance(user_dictionary, cls):
+            raise ValueError(f"{filepath} is not a compiled user dictionary")
+        return user_dictionary
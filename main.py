@@ -1,10 +1,12 @@
 import argparse
+import itertools
+import sys
 from pathlib import Path
-from comugi.comugi import Comugi
+from comugi import server
+from comugi.formatter import FORMATTERS, TSV_HEADER
 from utils import const
 
 from time import time
-from tqdm import tqdm
 
 
 def argparser():
@@ -19,6 +21,12 @@ def argparser():
         default=default_dictionary,
         choices=const.DICTIONARIES,
     )
+    parser.add_argument(
+        "--bundle",
+        "-b",
+        help="Path to dictionary bundle (used instead of the separate files below)",
+        default=None,
+    )
     parser.add_argument(
         "--da_path",
         "-da",
@@ -28,11 +36,11 @@ def argparser():
         ),
     )
     parser.add_argument(
-        "--dict_path",
+        "--lexicon_path",
         "-d",
-        help="Path to dictionary",
+        help="Path to lexicon (vocabulary ids of the double array keys)",
         default=Path(
-            f"{const.DATA_DIR}/{default_dictionary}-{const.DICTIONARY_FILE_SUFFIX}"
+            f"{const.DATA_DIR}/{default_dictionary}-{const.LEXICON_FILE_SUFFIX}"
         ),
     )
     parser.add_argument(
@@ -67,46 +75,186 @@ def argparser():
             f"{const.DATA_DIR}/{default_dictionary}-{const.CATEGORY_POLICY_FILE_SUFFIX}"
         ),
     )
+    parser.add_argument(
+        "--user_dictionary",
+        "-u",
+        help="user dictionary : mecab format csv (utf-8), or compiled one saved by "
+        "Comugi.save_user_dictionary, which replaces the ones given before it (repeatable)",
+        action="append",
+        default=[],
+    )
     parser.add_argument(
         "--nbest", "-n", help="N best path analysis", type=int, default=1
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--processes",
+        "-p",
+        help="tokenize all lines of stdin with a pool of processes",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--input", "-i", help="input file (stdin by default)", default=None
+    )
+    parser.add_argument(
+        "--output", "-o", help="output file (stdout by default)", default=None
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        help="output format",
+        default="tsv",
+        choices=("tsv", "jsonl", "wakati"),
+    )
+    parser.add_argument(
+        "--serve",
+        help="load the dictionaries once and serve requests on this unix socket",
+        default=None,
+    )
+    parser.add_argument(
+        "--connect",
+        help="tokenize with the server on this unix socket (the dictionaries are not loaded)",
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        help="print time of each phase and counters of lattices to stderr (not with --processes)",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    if args.profile and args.processes > 1:
+        # stats are collected by this process, while lines are tokenized by the workers
+        parser.error("--profile cannot be used with --processes")
+    return args
 
 
-def run(comugi, sentence, n_best):
-    results = comugi.tokenize(sentence, n_best)
-    print(f"表層型\t品詞\t品詞1\t原型\t発音")
-    for tokens in results:
-        for t in tokens:
-            node = comugi.get_node(t)
-            print(
-                f"{node.surface}\t{node.item['pos']}\t{node.item['pos1']}\t{node.item['base']}\t{node.item['pronunciation']}"
-            )
+OUTPUT_BUFFER_SIZE = 1 << 20
 
 
-if __name__ == "__main__":
-    args = argparser()
+def read_lines(f, interactive):
+    for line in f:
+        line = line.rstrip()
+        if interactive and line == "exit":
+            break
+        yield line
+
+
+def tokenize_lines(comugi, lines, n_best, processes):
+    if processes > 1:
+        lines, sentences = itertools.tee(lines)
+        yield from zip(lines, comugi.tokenize_many(sentences, n_best, processes))
+    else:
+        for line in lines:
+            yield line, comugi.tokenize(line, n_best)
+
+
+def run(comugi, lines, out, n_best=1, processes=1, fmt="tsv", flush=False):
+    formatter = FORMATTERS[fmt]
+    if fmt == "tsv":
+        out.write(TSV_HEADER)
+    for sentence, results in tokenize_lines(comugi, lines, n_best, processes):
+        out.write(formatter(comugi, sentence, results))
+        if flush:
+            out.flush()
+
+
+def run_client(client, lines, out, n_best=1, fmt="tsv", flush=False):
+    if fmt == "tsv":
+        out.write(TSV_HEADER)
+    # lines are sent one by one in the interactive mode
+    batch_size = 1 if flush else server.BATCH_SIZE
+    for output in client.tokenize_lines(lines, n_best, fmt, batch_size):
+        out.write(output)
+        if flush:
+            out.flush()
+
+
+def load_comugi(args):
+    # imported here so that the client does not pay for it
+    from comugi.comugi import Comugi
 
     start = time()
-    comugi = Comugi(
-        args.da_path,
-        args.dict_path,
-        args.vocab_path,
-        args.mat_path,
-        args.char_range_path,
-        args.char_policy_path,
-    )
+    if args.bundle is not None:
+        comugi = Comugi.from_bundle(args.bundle)
+    else:
+        comugi = Comugi(
+            args.da_path,
+            args.lexicon_path,
+            args.vocab_path,
+            args.mat_path,
+            args.char_range_path,
+            args.char_policy_path,
+        )
+    for path in args.user_dictionary:
+        if str(path).endswith(".csv"):
+            comugi.add_user_dictionary(path)
+        else:
+            comugi.load_user_dictionary(path)
     end = time()
-    print(f"time = {end - start:.3f}")
+    print(f"time = {end - start:.3f}", file=sys.stderr)
+    return comugi
+
+
+if __name__ == "__main__":
+    args = argparser()
+
+    if args.connect is not None:
+        client = server.ComugiClient(args.connect)
+    else:
+        client = None
+        comugi = load_comugi(args)
+        if args.profile:
+            comugi.enable_stats()
+
+    if args.serve is not None:
+        print(f"serving on {args.serve}", file=sys.stderr)
+        server.serve(comugi, args.serve)
+        if args.profile:
+            print(comugi.stats.report(), file=sys.stderr)
+        sys.exit(0)
 
     # message = "「その意見、僕はagreeです」や、「プライオリティ高めでお願いします👊」などの横文字ビジネス会話"
 
-    print("input sentence (press 'exit' to exit)")
-    while True:
-        message = input()
-        message = message.rstrip()
-        if message == "exit":
-            break
+    if args.input is None:
+        fin = open(sys.stdin.fileno(), "r", encoding="utf-8", closefd=False)
+    else:
+        fin = open(args.input, "r", encoding="utf-8")
+    if args.output is None:
+        fout = open(
+            sys.stdout.fileno(),
+            "w",
+            encoding="utf-8",
+            buffering=OUTPUT_BUFFER_SIZE,
+            closefd=False,
+        )
+    else:
+        fout = open(args.output, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE)
 
-        run(comugi, message, args.nbest)
+    interactive = args.input is None and sys.stdin.isatty()
+    if interactive:
+        print("input sentence (press 'exit' to exit)", file=sys.stderr)
+
+    with fin, fout:
+        if client is not None:
+            with client:
+                run_client(
+                    client,
+                    read_lines(fin, interactive),
+                    fout,
+                    args.nbest,
+                    args.format,
+                    flush=interactive,
+                )
+        else:
+            run(
+                comugi,
+                read_lines(fin, interactive),
+                fout,
+                args.nbest,
+                args.processes,
+                args.format,
+                flush=interactive,
+            )
 
+    if client is None and args.profile:
+        print(comugi.stats.report(), file=sys.stderr)
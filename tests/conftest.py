@@ -0,0 +1,27 @@
+import contextlib
+import io
+import pytest
+import build
+from benchmarks.bench_suite import DICT_TYPE, data_paths
+from benchmarks.synthetic import SyntheticDictionary
+from comugi.comugi import Comugi
+
+
+@pytest.fixture(scope="session")
+def synthetic():
+    return SyntheticDictionary(2000, n_ids=30, seed=0)
+
+
+@pytest.fixture(scope="session")
+def data_dir(synthetic, tmp_path_factory):
+    """directory of the dictionaries built from the synthetic dictionary"""
+    work_dir = tmp_path_factory.mktemp("dictionary")
+    synthetic.write(work_dir / "dict")
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        build.build(work_dir / "dict", DICT_TYPE, work_dir / "data")
+    return work_dir / "data"
+
+
+@pytest.fixture(scope="session")
+def comugi(data_dir):
+    return Comugi(*data_paths(data_dir))
@@ -0,0 +1,25 @@
+import asyncio
+import pytest
+from comugi.aio import AsyncComugi
+
+
+def test_tokenize(comugi):
+    async def run():
+        async with AsyncComugi(comugi, max_batch_size=4) as ac:
+            return await asyncio.gather(*(ac.tokenize(s) for s in sentences))
+
+    sentences = ["テスト", "あいう", "漢字", "abc"] * 3
+    results = asyncio.run(run())
+    assert results == [comugi.tokenize(s) for s in sentences]
+
+
+def test_close_while_collecting_batch(comugi):
+    async def run():
+        ac = AsyncComugi(comugi, max_batch_size=64, max_delay=0.5)
+        pending = asyncio.ensure_future(ac.tokenize("テスト"))
+        await asyncio.sleep(0.05)  # taken by the batcher, which waits for more requests
+        await ac.close()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(pending, 1)
+
+    asyncio.run(run())
@@ -0,0 +1,28 @@
+import pytest
+from comugi.bundle import BundleError, DictionaryBundle
+from comugi.comugi import Comugi
+
+
+def test_round_trip(comugi, tmp_path):
+    path = tmp_path / "dict.bin"
+    comugi.save_bundle(path, "mecab-ipa")
+    loaded = Comugi.from_bundle(path, verify=True)
+    for sentence in ("テスト", "漢字とかなのabc123", "すもももももも"):
+        assert loaded.tokenize(sentence, 3) == comugi.tokenize(sentence, 3)
+
+
+@pytest.mark.parametrize("content", [b"", b"COMUGI", b"\0" * 100])
+def test_not_a_bundle(tmp_path, content):
+    path = tmp_path / "dict.bin"
+    path.write_bytes(content)
+    with pytest.raises(BundleError):
+        DictionaryBundle(path)
+
+
+def test_truncated(comugi, tmp_path):
+    path = tmp_path / "dict.bin"
+    comugi.save_bundle(path, "mecab-ipa")
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) // 2])
+    with pytest.raises(BundleError):
+        DictionaryBundle(path)
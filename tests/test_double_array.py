@@ -0,0 +1,37 @@
+import random
+import pytest
+from comugi.double_array import DoubleArray
+
+
+def random_keys(rng, alphabet, n, max_length):
+    return [
+        "".join(rng.choice(alphabet) for _ in range(rng.randrange(1, max_length)))
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("tail", [False, True])
+def test_insert_after_build(tail):
+    chars = [chr(c) for c in range(0x21, 0x7F)] + [chr(c) for c in range(0x3041, 0x3094)]
+    for seed in range(200):
+        rng = random.Random(seed)
+        alphabet = rng.sample(chars, rng.randrange(2, 40))
+        keys = sorted(set(random_keys(rng, alphabet, rng.randrange(1, 30), 6)))
+        da = DoubleArray()
+        da.build(keys, list(range(len(keys))), tail=tail)
+
+        expected = {key: i for i, key in enumerate(keys)}
+        for i, key in enumerate(random_keys(rng, alphabet + ["漢"], rng.randrange(1, 30), 7)):
+            da.insert(key.encode("utf-8"), 1000 + i)
+            expected[key] = 1000 + i
+        for key, value in expected.items():
+            assert da.lookup(key.encode("utf-8")) == value
+
+
+def test_load_rejects_other_formats(tmp_path):
+    path = tmp_path / "da.dic"
+    path.write_text("2\n1 2\n")  # the old text format
+    with pytest.raises(ValueError):
+        DoubleArray().load(str(path))
+    with pytest.raises(FileNotFoundError):
+        DoubleArray().load(str(tmp_path / "missing.dic"))
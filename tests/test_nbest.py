@@ -0,0 +1,52 @@
+import random
+import sys
+
+
+def path_cost(cm, path):
+    cost = sum(node.em_cost for node in path[1:-1])
+    for lnode, rnode in zip(path, path[1:]):
+        cost += cm.get_transition_cost(lnode, rnode)
+    return cost
+
+
+def all_path_costs(lattice, cm):
+    """costs of all the paths from BOS to EOS"""
+    costs = []
+    length = len(lattice.sentence)
+
+    def visit(path, pos):
+        if pos == length:
+            costs.append(path_cost(cm, path + [lattice.eos_node]))
+            return
+        for node in lattice.begin_nodes[pos]:
+            if node is not lattice.eos_node:
+                visit(path + [node], pos + node.length)
+
+    visit([lattice.bos_node], 0)
+    return sorted(costs)
+
+
+def test_nbest_against_brute_force(comugi, synthetic):
+    rng = random.Random(0)
+    cm = comugi.cost_manager
+    n_best = 15
+    # short sentences, so that all the paths can be enumerated
+    sentences = [
+        synthetic.text(rng.randrange(4, 12), mix, rng)
+        for mix in ("hiragana", "kanji", "mixed")
+        for _ in range(40)
+    ]
+    for sentence in sentences:
+        with comugi.lattice_pool.lattice() as lattice:
+            comugi.set_lattice(sentence, lattice)
+            paths = lattice.calc_path(cm, n_best)
+            costs = [path_cost(cm, path) for path in paths]
+            expected = all_path_costs(lattice, cm)[:n_best]
+
+            assert costs == expected
+            if len(expected) == 0:  # EOS is not reachable
+                continue
+            assert paths[0] == lattice.get_best_path()[0]
+            for path in paths:
+                assert path[0] is lattice.bos_node and path[-1] is lattice.eos_node
+                assert all(node.min_cost != sys.maxsize for node in path)
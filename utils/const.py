@@ -1,10 +1,11 @@
 DATA_DIR = "./data"
 DOUBLEARRAY_FILE_SUFFIX = "da.dic"
-DICTIONARY_FILE_SUFFIX = 'dic.pkl'
+LEXICON_FILE_SUFFIX = 'lex.pkl'
 VOCABULARY_FILE_SUFFIX = 'voc.pkl'
 UNKNOWN_DICTIONARY_FILE_SUFFIX = 'unk-dic.pkl'
-MATRIX_FILE_SUFFIX = 'mat.pkl'
+MATRIX_FILE_SUFFIX = 'mat.npy'
 CATEGORY_POLICY_FILE_SUFFIX = 'cat_pol.pkl'
 CATEGORY_RANGE_FILE_SUFFIX = 'cat_ran.pkl'
+BUNDLE_FILE_SUFFIX = 'dict.bin'
 
 DICTIONARIES = ("mecab-ipa", "mecab-juman", "mecab-neologd", "mecab-unidic")
\ No newline at end of file
@@ -1,18 +1,23 @@
+import io
+import os
 import sys
 import csv
 import pickle
+import multiprocessing as mp
 from collections import defaultdict
 from pathlib import Path
+import numpy as np
+from comugi.lattice import VocabContainer
 
 
-def load_dictionary(dict_path, dict_type="mecab-ipa"):
+def load_dictionary(dict_path, dict_type="mecab-ipa", processes=None):
     if (
         dict_type == "mecab-ipa"
         or dict_type == "mecab-juman"
         or dict_type == "mecab-neologd"
         or dict_type == "mecab-unidic"
     ):
-        return load_vocabulary(dict_path, dict_type)
+        return load_vocabulary(dict_path, dict_type, processes)
 
 
 def load_cost_matrix(dict_path, dict_type="mecab-ipa"):
@@ -26,19 +31,27 @@ def load_cost_matrix(dict_path, dict_type="mecab-ipa"):
 
     mat_path = Path(f"{dict_path}/{mat_def_file}")
     if not mat_path.is_file():
-        print(f"{mat_path} is not found.")
-        sys.exit()
+        print(f"{mat_path} is not found.", file=sys.stderr)
+        sys.exit(1)
 
-    with open(mat_path, mode="r", encoding="euc_jp") as f:
+    # matrix.def consists of ascii numbers only, so all the lines are parsed at once
+    with open(mat_path, mode="rb") as f:
         header = f.readline()
         row, col = map(int, header.split())
-
-        cost_matrix = [[0 for _ in range(col)] for __ in range(row)]
-
-        lines = f.readlines()
-        for line in lines:
-            r, c, cost = map(int, line.split())
-            cost_matrix[r][c] = cost
+        values = np.fromstring(f.read(), dtype=np.int32, sep=" ")
+
+    if len(values) % 3 != 0:
+        print(f"{mat_path} is broken.", file=sys.stderr)
+        sys.exit(1)
+    values = values.reshape(-1, 3)
+
+    # int16 as CostManager keeps it, so the matrix is not copied (int32 if costs do not fit)
+    costs = values[:, 2]
+    info = np.iinfo(np.int16)
+    fits = len(costs) == 0 or (info.min <= costs.min() and costs.max() <= info.max)
+    cost_matrix = np.zeros((row, col), dtype=np.int16 if fits else np.int32)
+    cost_matrix[values[:, 0], values[:, 1]] = costs
+    del values, costs
     return cost_matrix
 
 
@@ -65,22 +78,75 @@ def format_item(item, is_known, dict_type):
     return formatted
 
 
-def load_vocabulary(dict_path, dict_type):
-    dictionary = defaultdict(list)
-    count = 0
-    vocabularies = []
+# size of the byte range of a csv file parsed by one task
+CHUNK_SIZE = 1 << 22
+
+
+def split_csv(csv_file, chunk_size=None):
+    """
+    split csv_file into byte ranges at line boundaries
+    A newline byte never appears in a multibyte character of euc_jp (or utf-8), and
+    fields of mecab dictionaries do not contain newlines.
+    """
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    size = csv_file.stat().st_size
+    ranges = []
+    with open(csv_file, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()  # move to the end of the line
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_csv_chunk(task):
+    """parse a byte range of a csv file into columnar vocabularies"""
+    csv_file, start, end, dict_type = task
+    with open(csv_file, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("euc_jp")
+    items = [
+        format_item(item, is_known=True, dict_type=dict_type)
+        for item in csv.reader(io.StringIO(text, newline=None))
+    ]
+    return VocabContainer.from_items(items)
+
+
+def load_vocabulary(dict_path, dict_type, processes=None):
+    """
+    parse all csv files of the dictionary with a pool of processes
+    Files and large files split into chunks are parsed in parallel, and the chunks are
+    joined in the order of the files, so vocabulary ids are the same as parsing serially.
+    Returns surface -> vocabulary ids, and VocabContainer of all the vocabularies
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    tasks = []
     for csv_file in Path(dict_path).glob("*.csv"):
         print(f"Loading {csv_file}")
-        with open(csv_file, mode="r", encoding="euc_jp") as f:
-            reader = csv.reader(f)
-            for item in reader:
-                item = format_item(item, is_known=True, dict_type=dict_type)
-                dictionary[item["surface"]].append(count)
-                vocabularies.append(item)
-                count += 1
+        tasks.extend(
+            (csv_file, start, end, dict_type) for start, end in split_csv(csv_file)
+        )
+
+    if processes > 1 and len(tasks) > 1:
+        with mp.Pool(min(processes, len(tasks))) as pool:
+            vocab_container = VocabContainer.concat(pool.imap(parse_csv_chunk, tasks))
+    else:
+        vocab_container = VocabContainer.concat(map(parse_csv_chunk, tasks))
+
+    dictionary = defaultdict(list)
+    strings = vocab_container.strings
+    surfaces = [strings[i] for i in range(len(strings))]
+    for count, surface in enumerate(vocab_container.surface):
+        dictionary[surfaces[surface]].append(count)
 
     print(f"Vocabulary size = {len(list(dictionary.keys()))}")
-    return dictionary, vocabularies
+    return dictionary, vocab_container
 
 
 def load_unk_dictionary(dict_path, dict_type="mecab-ipa"):